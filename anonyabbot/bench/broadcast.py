@@ -0,0 +1,103 @@
+"""Fan-out throughput of a real GroupBot worker against a fake Telegram client."""
+
+import asyncio
+from pathlib import Path
+import time
+from typing import List
+
+from ..model import BanGroup, Group, Member, MemberRole, Message, User, db, partitions
+from ..bot.group import GroupBot
+from ..bot.group.worker import BroadcastOperation
+from .common import LagMonitor, QueryCounter, percentile, reset_database
+from .fake import FakeClient
+
+
+def populate(n_members: int, token: str):
+    """Create a group with n_members members (including the creator), returns the group."""
+    with db.atomic():
+        creator = User.create(uid=10**9, firstname="Creator")
+        group = Group.create(
+            uid=1,
+            token=token,
+            username="benchgroup",
+            title="Bench Group",
+            creator=creator,
+            default_ban_group=BanGroup.generate(),
+        )
+        Member.create(group=group, user=creator, role=MemberRole.CREATOR)
+        users = [{"uid": 10**9 + i, "firstname": f"User {i}"} for i in range(1, n_members)]
+        for i in range(0, len(users), 500):
+            User.insert_many(users[i : i + 500]).execute()
+        members = [
+            {"group": group.id, "user": u.id, "role": MemberRole.MEMBER}
+            for u in User.select(User.id).where(User.uid > 10**9).iterator()
+        ]
+        for i in range(0, len(members), 500):
+            Member.insert_many(members[i : i + 500]).execute()
+    return group
+
+
+async def run_case(workdir: Path, n_members: int, n_messages: int, client: FakeClient):
+    reset_database(workdir / f"broadcast_{n_members}.db")
+    token = f"{n_members}:bench"
+    group = populate(n_members, token)
+    partitions.bind(group.id)
+    sender = Member.get(group=group, role=MemberRole.CREATOR)
+
+    gb = GroupBot(token)
+    gb.bot = gb.queue._bot = client
+    gb.start_worker()
+
+    lag = LagMonitor()
+    queries = QueryCounter()
+    lag.start()
+    delivery: List[float] = []
+
+    async def broadcast(i: int):
+        context = client.message(sender.user.uid, text=f"Benchmark message {i}")
+        message = Message.create(group=group, mid=context.id, member=sender, mask="🎭")
+        op = BroadcastOperation(context=context, member=sender, message=message)
+        start = time.perf_counter()
+        await gb.queue.put(op)
+        await op.finished.wait()
+        delivery.append(time.perf_counter() - start)
+        return op
+
+    start = time.perf_counter()
+    ops = await asyncio.gather(*[broadcast(i) for i in range(n_messages)])
+    spent = time.perf_counter() - start
+
+    lag.stop()
+    gb.worker_task.cancel()
+    recipients = sum(op.requests for op in ops)
+    return {
+        "members": n_members,
+        "messages": n_messages,
+        "seconds": spent,
+        "messages_per_second": n_messages / spent,
+        "deliveries_per_second": recipients / spent,
+        "delivery_p50": percentile(delivery, 50),
+        "delivery_p99": percentile(delivery, 99),
+        "requests": recipients,
+        "errors": sum(op.errors for op in ops),
+        "floods": client.floods,
+        "queries_per_recipient": queries.count / recipients if recipients else 0.0,
+        "loop_lag": lag.summary(),
+    }
+
+
+async def run(
+    workdir: Path,
+    sizes=(10, 100, 1000, 10000),
+    messages: int = 10,
+    latency: float = 0.05,
+    jitter: float = 0.02,
+    error_rate: float = 0.0,
+    flood_rate: float = 0.0,
+    flood_wait: int = 1,
+):
+    results = []
+    for n in sizes:
+        client = FakeClient(latency, jitter, error_rate=error_rate, flood_rate=flood_rate, flood_wait=flood_wait)
+        results.append(await run_case(workdir, n, messages, client))
+    return results
@@ -0,0 +1,90 @@
+"""Throughput of message classification on long texts, compared with per-type checking."""
+
+import json
+import random
+import re
+import string
+import time
+from types import SimpleNamespace
+
+from pyrogram.enums import MessageEntityType
+
+from ..bot.group.on_message import LINK_ENTITIES, LINK_PATTERN, classify_message
+from ..model import BanType
+
+
+def legacy_classify(message):
+    """Classification as done before the single-pass classifier, with one check per ban type."""
+    mask = BanType.MESSAGE.bit
+    if message.media:
+        mask |= BanType.MEDIA.bit
+    if message.sticker:
+        mask |= BanType.STICKER.bit
+    if message.reply_markup:
+        mask |= BanType.MARKUP.bit
+    if message.entities:
+        for e in message.entities:
+            if e.type in [
+                MessageEntityType.URL,
+                MessageEntityType.TEXT_LINK,
+                MessageEntityType.MENTION,
+                MessageEntityType.TEXT_MENTION,
+            ]:
+                mask |= BanType.LINK.bit
+    content = message.text or message.caption
+    if content:
+        if len(content) > 200:
+            mask |= BanType.LONG.bit
+        if re.search(LINK_PATTERN.pattern, content):
+            mask |= BanType.LINK.bit
+    return mask
+
+
+def generate_messages(n: int, length: int, link_ratio: float = 0.1, entity_ratio: float = 0.2, seed: int = 0):
+    rng = random.Random(seed)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(500)]
+    messages = []
+    for _ in range(n):
+        text = []
+        size = 0
+        while size < length:
+            w = rng.choice(words)
+            text.append(w)
+            size += len(w) + 1
+        if rng.random() < link_ratio:
+            text.insert(rng.randrange(len(text)), f"https://www.{rng.choice(words)}.com/{rng.choice(words)}")
+        entities = None
+        if rng.random() < entity_ratio:
+            entities = [SimpleNamespace(type=rng.choice([MessageEntityType.BOLD, MessageEntityType.ITALIC, *LINK_ENTITIES]))]
+        messages.append(
+            SimpleNamespace(
+                text=" ".join(text),
+                caption=None,
+                media=None,
+                sticker=None,
+                reply_markup=None,
+                entities=entities,
+            )
+        )
+    return messages
+
+
+def run(n: int = 2000, lengths=(200, 1000, 4096), repeat: int = 3):
+    results = []
+    for length in lengths:
+        messages = generate_messages(n, length)
+        for name, func in (("legacy", legacy_classify), ("classifier", classify_message)):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for m in messages:
+                    func(m)
+                spent = time.perf_counter() - start
+                best = spent if best is None else min(best, spent)
+            results.append({"name": name, "length": length, "messages": n, "seconds": best, "per_second": n / best})
+        assert [legacy_classify(m) for m in messages] == [classify_message(m) for m in messages]
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,182 @@
+import asyncio
+from pathlib import Path
+import sys
+from typing import List
+
+from loguru import logger
+import typer
+
+from .. import __product__, __version__
+from ..config import config
+from .common import prepare, save
+
+logger.remove()
+logger.add(sys.stderr, level="INFO")
+
+app = typer.Typer(
+    pretty_exceptions_show_locals=False,
+    rich_markup_mode="rich",
+    add_completion=False,
+    context_settings={"help_option_names": ["-h", "--help"]},
+    help=f"Benchmarks for [orange3]{__product__.capitalize()}[/] {__version__}.",
+)
+
+state = {}
+
+
+@app.callback()
+def main(
+    config_file: Path = typer.Option(
+        None,
+        "--config",
+        "-c",
+        dir_okay=False,
+        help="Config toml file, redis and basedir are always replaced by temporary ones",
+    ),
+):
+    state["workdir"] = prepare(config_file)
+
+
+@app.command(help="Message classification throughput on long texts.")
+def classifier(
+    n: int = typer.Option(2000, help="Messages per text length"),
+    output: Path = typer.Option(None, "--output", "-o", dir_okay=False, help="Save results as JSON"),
+):
+    from .classifier import run
+
+    results = run(n=n)
+    save("classifier", {"n": n}, results, output)
+    for r in results:
+        typer.echo(f"{r['name']:>12} {r['length']:>6} chars: {r['per_second']:,.0f} msg/s")
+
+
+@app.command(help="Broadcast fan-out of a real GroupBot worker against a fake Telegram client.")
+def broadcast(
+    sizes: List[int] = typer.Option([10, 100, 1000, 10000], "--size", "-s", help="Group sizes to test"),
+    messages: int = typer.Option(10, help="Messages broadcasted per group size"),
+    latency: float = typer.Option(0.05, help="Mean latency of API calls in seconds"),
+    jitter: float = typer.Option(0.02, help="Standard deviation of API call latency"),
+    error_rate: float = typer.Option(0.0, help="Ratio of API calls failing with an RPC error"),
+    flood_rate: float = typer.Option(0.0, help="Ratio of API calls answered with a FloodWait"),
+    flood_wait: int = typer.Option(1, help="Seconds of each injected FloodWait"),
+    output: Path = typer.Option(None, "--output", "-o", dir_okay=False, help="Save results as JSON"),
+):
+    from .broadcast import run
+
+    parameters = {
+        "sizes": sizes,
+        "messages": messages,
+        "latency": latency,
+        "jitter": jitter,
+        "error_rate": error_rate,
+        "flood_rate": flood_rate,
+        "flood_wait": flood_wait,
+    }
+    results = asyncio.run(run(state["workdir"], **parameters))
+    save("broadcast", parameters, results, output)
+    for r in results:
+        typer.echo(
+            f"{r['members']:>6} members: {r['messages_per_second']:.2f} msg/s, "
+            f"{r['deliveries_per_second']:.0f} deliveries/s, "
+            f"p50/p99 {r['delivery_p50']:.2f}/{r['delivery_p99']:.2f}s, "
+            f"{r['queries_per_recipient']:.1f} queries/recipient, "
+            f"lag p99 {r['loop_lag']['p99'] * 1000:.0f}ms"
+        )
+
+
+@app.command(help="Generate a synthetic dataset with skewed group sizes and activity.")
+def generate(
+    path: Path = typer.Argument(..., dir_okay=False, help="SQLite database file to create"),
+    users: int = typer.Option(10000, help="Number of users"),
+    groups: int = typer.Option(100, help="Number of groups"),
+    messages: int = typer.Option(10000, help="Number of messages"),
+    max_members: int = typer.Option(1000, help="Members of the largest group"),
+    days: int = typer.Option(30, help="Messages are spread over this many days"),
+    redirect_format: str = typer.Option("rows", help='Storage of redirections, "rows" or "packed"'),
+    seed: int = typer.Option(0, help="Random seed"),
+    force: bool = typer.Option(False, "--force", "-f", help="Replace an existing database"),
+):
+    from .dataset import generate
+
+    if path.exists():
+        if not force:
+            logger.error(f'Database "{path}" exists, use "--force" to replace it.')
+            raise typer.Exit(1)
+        for f in (path, path.with_name(path.name + "-wal"), path.with_name(path.name + "-shm")):
+            f.unlink(missing_ok=True)
+    config["database"] = {**config.get("database", {}), "redirect_format": redirect_format}
+    counts = generate(path, users, groups, messages, max_members, days, redirect_format, seed)
+    for name, count in counts.items():
+        typer.echo(f"{name:>18}: {count}")
+
+
+@app.command(help="Latency and query counts of hot-path model queries on a generated dataset.")
+def queries(
+    path: Path = typer.Argument(..., exists=True, dir_okay=False, help="SQLite database made by generate"),
+    n: int = typer.Option(1000, "-n", help="Calls per query"),
+    redirect_format: str = typer.Option("rows", help='Storage of redirections used by the dataset, "rows" or "packed"'),
+    large_group: int = typer.Option(0, help="Messages of an extra single-group dataset built in bulk, 0 to skip"),
+    output: Path = typer.Option(None, "--output", "-o", dir_okay=False, help="Save results as JSON"),
+):
+    from .queries import run, large_group as run_large_group
+
+    config["database"] = {**config.get("database", {}), "redirect_format": redirect_format}
+    results = run(path, n=n)
+    if large_group:
+        results += run_large_group(state["workdir"] / "large_group.db", messages=large_group, n=min(n, 100))
+    parameters = {"path": str(path), "n": n, "redirect_format": redirect_format, "large_group": large_group}
+    save("queries", parameters, results, output)
+    for r in results:
+        typer.echo(
+            f"{r['name']:>28}: mean {r['mean'] * 1000:.3f}ms, p99 {r['p99'] * 1000:.3f}ms, "
+            f"{r['queries_per_call']:.1f} queries/call"
+        )
+
+
+@app.command(help="Replay a recorded or synthetic update stream into real bot handlers through fake clients.")
+def replay(
+    trace_file: Path = typer.Argument(None, exists=True, dir_okay=False, help="Trace recorded with \"replay.record\", synthetic if omitted"),
+    users: int = typer.Option(100, help="Synthetic users"),
+    events: int = typer.Option(1000, help="Synthetic events after users joined"),
+    rate: float = typer.Option(10.0, help="Synthetic events per second"),
+    groups: int = typer.Option(1, help="Group bots to replay into"),
+    speed: float = typer.Option(1.0, help="Replay speed relative to trace times"),
+    latency: float = typer.Option(0.05, help="Mean latency of API calls in seconds"),
+    jitter: float = typer.Option(0.02, help="Standard deviation of API call latency"),
+    workers: int = typer.Option(128, help="Concurrent handlers, as pyrogram workers"),
+    save_trace: Path = typer.Option(None, dir_okay=False, help="Save the synthetic trace for later replays"),
+    output: Path = typer.Option(None, "--output", "-o", dir_okay=False, help="Save results as JSON"),
+):
+    from .replay import dump, load, run, synthesize
+
+    if trace_file:
+        trace = load(trace_file)
+    else:
+        trace = synthesize(users=users, events=events, groups=groups, rate=rate)
+        if save_trace:
+            dump(trace, save_trace)
+    parameters = {
+        "trace": str(trace_file) if trace_file else None,
+        "users": users,
+        "events": events,
+        "rate": rate,
+        "groups": groups,
+        "speed": speed,
+        "latency": latency,
+        "jitter": jitter,
+        "workers": workers,
+    }
+    result = asyncio.run(run(state["workdir"], trace, groups=groups, speed=speed, latency=latency, jitter=jitter, workers=workers))
+    save("replay", parameters, [result], output)
+    typer.echo(
+        f"{result['events']} events in {result['seconds']:.1f}s ({result['events_per_second']:.1f}/s), "
+        f"{result['queries_per_event']:.1f} queries/event, {result['cache_ops_per_event']:.1f} cache ops/event, "
+        f"queue depth p99 {result['queue_depth']['p99']}, lag p99 {result['loop_lag']['p99'] * 1000:.0f}ms"
+    )
+    for kind, l in result["latency"].items():
+        typer.echo(f"{kind:>10}: {l['count']:>6} handled, p50/p99 {l['p50']:.2f}/{l['p99']:.2f}s")
+    for name, h in sorted(result["handlers"].items(), key=lambda x: x[1]["calls"], reverse=True):
+        typer.echo(
+            f"{name:>32}: {h['calls']:>6} calls, p99 <{h['p99']}s, {h['queries']:.1f} queries "
+            f"({h['db_time'] * 1000:.1f}ms), {h['cache_ops']:.1f} cache ops, {h['api_calls']:.1f} API calls"
+        )
@@ -0,0 +1,133 @@
+import asyncio
+from datetime import datetime
+import json
+from pathlib import Path
+import platform
+import tempfile
+from typing import List
+
+from loguru import logger
+
+from .. import __version__
+from ..cache import Cache
+from ..config import config
+from ..model import BanGroup, RedirectMap, RedirectIndex, User, BaseModel, db, init_database, sqlite_pragmas
+
+BENCH_CONF = """
+[tele]
+api_id = "1"
+api_hash = "00000000000000000000000000000000"
+
+[father]
+token = "0:bench"
+"""
+
+
+def prepare(config_file: Path = None):
+    """Load config for benchmarks, with caches and data kept in a temporary directory."""
+    workdir = Path(tempfile.mkdtemp(prefix="anonyabbot-bench-"))
+    if not config_file:
+        config_file = workdir / "config.toml"
+        config_file.write_text(BENCH_CONF)
+    config.reload_conf(config_file)
+    config["basedir"] = str(workdir)
+    config["redis"] = None
+    return workdir
+
+
+def reset_database(path: Path):
+    """Initialize a fresh database at path, and drop in-memory caches of the previous one."""
+    if db.obj:
+        db.close()
+    init_database(path, pragmas=sqlite_pragmas())
+    db.create_tables(BaseModel.__subclasses__())
+    User.role_cache.clear()
+    BanGroup.cache.clear()
+    RedirectMap.pending.clear()
+    RedirectIndex.pending.clear()
+
+
+class QueryCounter:
+    """Count SQL statements executed by the current database."""
+
+    def __init__(self):
+        self.count = 0
+        database = db.obj
+        execute_sql = database.execute_sql
+
+        def counted(*args, **kw):
+            self.count += 1
+            return execute_sql(*args, **kw)
+
+        database.execute_sql = counted
+
+
+class CacheCounter:
+    """Count commands sent to the cache backend."""
+
+    def __init__(self):
+        self.count = 0
+        if not Cache.source:
+            Cache.refresh()
+        source = Cache.source
+        execute_command = source.execute_command
+
+        def counted(*args, **kw):
+            self.count += 1
+            return execute_command(*args, **kw)
+
+        source.execute_command = counted
+
+
+class LagMonitor:
+    """Sample event loop lag, as the delay of a periodic sleep beyond its interval."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: List[float] = []
+        self.task: asyncio.Task = None
+
+    async def _watch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        self.task = asyncio.create_task(self._watch())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    def summary(self):
+        return {
+            "p50": percentile(self.samples, 50),
+            "p99": percentile(self.samples, 99),
+            "max": max(self.samples, default=0.0),
+        }
+
+
+def percentile(values: List[float], p: float):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def save(name: str, parameters: dict, results: list, output: Path = None):
+    """Save results as JSON together with run environment, returns the report."""
+    report = {
+        "benchmark": name,
+        "version": __version__,
+        "time": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": parameters,
+        "results": results,
+    }
+    if output:
+        output.write_text(json.dumps(report, indent=2))
+        logger.info(f'Results are saved to "{output}".')
+    return report
@@ -0,0 +1,223 @@
+"""Synthetic production-sized data, with skewed group sizes, memberships and chattiness."""
+
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+from pathlib import Path
+import random
+
+from loguru import logger
+
+from ..model import (
+    BanGroup,
+    BanGroupEntry,
+    BanType,
+    Group,
+    Member,
+    MemberRole,
+    Message,
+    RedirectedMessage,
+    RedirectIndex,
+    RedirectMap,
+    Statistic,
+    User,
+    UserRole,
+    Validation,
+    db,
+)
+from .common import reset_database
+
+UID_BASE = 10**9
+
+
+class Sampler:
+    """Draw indexes with Zipf-like popularity, index 0 being the most popular."""
+
+    def __init__(self, rng: random.Random, n: int, skew: float):
+        self.rng = rng
+        self.cum = list(accumulate(1 / (i + 1) ** skew for i in range(n)))
+
+    def draw(self):
+        return bisect(self.cum, self.rng.random() * self.cum[-1])
+
+    def distinct(self, k: int):
+        k = min(k, len(self.cum))
+        if k > len(self.cum) // 2:
+            return self.rng.sample(range(len(self.cum)), k)
+        results = set()
+        while len(results) < k:
+            results.add(self.draw())
+        return list(results)
+
+
+def insert(model, fields, rows, chunk: int = 1000):
+    for i in range(0, len(rows), chunk):
+        model.insert_many(rows[i : i + chunk], fields=fields).execute()
+
+
+def generate(
+    path: Path,
+    users: int = 10000,
+    groups: int = 100,
+    messages: int = 10000,
+    max_members: int = 1000,
+    days: int = 30,
+    redirect_format: str = "rows",
+    seed: int = 0,
+):
+    """Fill a new SQLite database at path with synthetic data, returns the number of rows of each table."""
+    rng = random.Random(seed)
+    now = datetime.now()
+    reset_database(path)
+
+    def ago(max_days: float):
+        # Recent times are denser, as in a growing deployment.
+        return now - timedelta(days=max_days * rng.random() ** 2)
+
+    with db.atomic():
+        insert(
+            User,
+            [User.id, User.uid, User.username, User.firstname, User.created],
+            [(i + 1, UID_BASE + i, f"user{i}", f"User {i}", ago(days * 4)) for i in range(users)],
+        )
+
+        validations = []
+        for i in range(users):
+            r = rng.random()
+            if r < 0.01:
+                role = UserRole.BANNED
+            elif r < 0.06:
+                role = UserRole.AWARDED
+            elif r < 0.09:
+                role = UserRole.PAYING
+            elif r < 0.0915:
+                role = UserRole.ADMIN
+            else:
+                continue
+            until = None if rng.random() < 0.5 else now + timedelta(days=rng.uniform(-days, days))
+            validations.append((i + 1, role, until, ago(days)))
+        insert(Validation, [Validation.user, Validation.role, Validation.until, Validation.created], validations)
+
+        user_sampler = Sampler(rng, users, 0.8)
+        sizes = sorted((min(max_members, int(5 * rng.paretovariate(1.0))) for _ in range(groups)), reverse=True)
+        sizes = [min(s, users) for s in sizes]
+        sizes[0] = min(max_members, users)
+        group_members = []
+        member_id = 0
+        ban_group_id = 0
+        member_rows = []
+        ban_groups = []
+        ban_entries = []
+
+        def ban_group(types, until=None):
+            nonlocal ban_group_id
+            ban_group_id += 1
+            ban_groups.append((ban_group_id, now, until, BanType.to_mask(types)))
+            ban_entries.extend((t, ban_group_id) for t in types)
+            return ban_group_id
+
+        creators = set()
+        bannable = [t for t in BanType if t != BanType.NONE]
+        group_rows = []
+        for g, size in enumerate(sizes):
+            gid = g + 1
+            indexes = user_sampler.distinct(size)
+            creator = indexes[0]
+            defaults = rng.sample(bannable, rng.choice([0, 0, 0, 1, 2]))
+            group_rows.append(
+                (gid, UID_BASE * 2 + g, f"{gid}:synthetic", f"group{g}", f"Group {g}", creator + 1, ago(days * 2), ago(days), ban_group(defaults))
+            )
+            members = []
+            for j, u in enumerate(indexes):
+                member_id += 1
+                if j == 0:
+                    role = MemberRole.CREATOR
+                else:
+                    r = rng.random()
+                    role = (
+                        MemberRole.ADMIN_BAN if r < 0.01
+                        else MemberRole.BANNED if r < 0.02
+                        else MemberRole.LEFT if r < 0.07
+                        else MemberRole.GUEST if r < 0.12
+                        else MemberRole.MEMBER
+                    )
+                banned = ban_group(rng.sample(bannable, 1), now + timedelta(days=1)) if rng.random() < 0.02 else None
+                member_rows.append((member_id, gid, u + 1, role, ago(days * 2), ago(days), banned))
+                if role >= MemberRole.GUEST:
+                    members.append(member_id)
+            group_members.append(members)
+            creators.add(creator)
+        insert(
+            Validation,
+            [Validation.user, Validation.role, Validation.until, Validation.created],
+            [(c + 1, UserRole.GROUPER, None, ago(days)) for c in creators],
+        )
+        insert(BanGroup, [BanGroup.id, BanGroup.created, BanGroup.until, BanGroup.mask], ban_groups)
+        insert(BanGroupEntry, [BanGroupEntry.type, BanGroupEntry.group], ban_entries)
+        insert(
+            Group,
+            [Group.id, Group.uid, Group.token, Group.username, Group.title, Group.creator, Group.created, Group.last_activity, Group.default_ban_group],
+            group_rows,
+        )
+        insert(
+            Member,
+            [Member.id, Member.group, Member.user, Member.role, Member.created, Member.last_activity, Member.ban_group],
+            member_rows,
+        )
+
+    # Larger groups are chattier in total but not per member, and a few members send most messages.
+    group_sampler_weights = list(accumulate(len(m) ** 0.5 for m in group_members))
+    message_rows = []
+    redirect_rows = []
+    maps = []
+    index_rows = []
+    last_message = {}
+    senders = {}
+    mid = 0
+    for message_id in range(1, messages + 1):
+        g = bisect(group_sampler_weights, rng.random() * group_sampler_weights[-1])
+        members = group_members[g]
+        if not members:
+            continue
+        if g not in senders:
+            senders[g] = Sampler(rng, len(members), 1.2)
+        sender = members[senders[g].draw()]
+        reply_to = last_message.get(g) if rng.random() < 0.2 else None
+        mid += 1
+        message_rows.append((message_id, g + 1, mid, sender, "🎭", reply_to, rng.random() < 0.001, ago(days)))
+        last_message[g] = message_id
+        pairs = {}
+        for m in members:
+            if m == sender:
+                continue
+            mid += 1
+            pairs[m] = mid
+        if redirect_format == "packed":
+            maps.append((message_id, RedirectMap.pack(pairs)))
+            index_rows.extend((m, r, message_id) for m, r in pairs.items())
+        else:
+            redirect_rows.extend((r, message_id, m) for m, r in pairs.items())
+        if len(redirect_rows) + len(index_rows) > 200000:
+            flush_messages(message_rows, redirect_rows, maps, index_rows)
+    flush_messages(message_rows, redirect_rows, maps, index_rows)
+    Statistic.recount()
+    for g in Group.select().iterator():
+        g.recount()
+
+    counts = {model.__name__: model.select().count() for model in (User, Validation, Group, Member, Message, RedirectedMessage, RedirectMap, RedirectIndex)}
+    logger.info(f"Synthetic dataset generated: {counts}.")
+    return counts
+
+
+def flush_messages(message_rows: list, redirect_rows: list, maps: list, index_rows: list):
+    with db.atomic():
+        insert(
+            Message,
+            [Message.id, Message.group, Message.mid, Message.member, Message.mask, Message.reply_to, Message.pinned, Message.created],
+            message_rows,
+        )
+        insert(RedirectedMessage, [RedirectedMessage.mid, RedirectedMessage.message, RedirectedMessage.to_member], redirect_rows)
+        insert(RedirectMap, [RedirectMap.message, RedirectMap.data], maps)
+        insert(RedirectIndex, [RedirectIndex.member, RedirectIndex.mid, RedirectIndex.message], index_rows)
+    for rows in (message_rows, redirect_rows, maps, index_rows):
+        rows.clear()
@@ -0,0 +1,202 @@
+import asyncio
+from collections import Counter, OrderedDict
+from datetime import datetime
+import itertools
+import random
+import inspect
+from typing import Dict, List
+
+from loguru import logger
+from pyrogram import ContinuePropagation, StopPropagation
+from pyrogram.enums import ChatType
+from pyrogram.errors import FloodWait, InternalServerError
+from pyrogram.handlers.handler import Handler
+from pyrogram.types import Chat, InlineKeyboardMarkup, Message as TM, User as TU
+
+from .. import telemetry
+
+
+class FakeClient:
+    """
+    In-process stand-in of pyrogram Client, with simulated latency, errors and flood waits for each API call.
+    Handlers added to it can be fed with updates through `dispatch`, as the pyrogram dispatcher does.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        jitter: float = 0.02,
+        error_rate: float = 0.0,
+        flood_rate: float = 0.0,
+        flood_wait: int = 1,
+        sleep_threshold: int = 60,
+        seed: int = 0,
+        me: TU = None,
+        bot_token: str = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.flood_wait = flood_wait
+        self.sleep_threshold = sleep_threshold
+        self.random = random.Random(seed)
+        self.me = me or TU(id=1, is_bot=True, first_name="Bench", username="benchbot")
+        self.bot_token = bot_token
+        self.calls = Counter()
+        self.errors = 0
+        self.floods = 0
+        self.delivered: Dict[int, List[int]] = {}
+        self.latest: Dict[int, TM] = {}
+        self.menus: Dict[int, TM] = {}
+        self.groups: Dict[int, List[Handler]] = OrderedDict()
+        self.executor = None
+        self._ids = itertools.count(1)
+
+    @property
+    def loop(self):
+        return asyncio.get_running_loop()
+
+    def add_handler(self, handler: Handler, group: int = 0):
+        if group not in self.groups:
+            self.groups[group] = []
+            self.groups = OrderedDict(sorted(self.groups.items()))
+        self.groups[group].append(handler)
+        return handler, group
+
+    def remove_handler(self, handler: Handler, group: int = 0):
+        self.groups[group].remove(handler)
+
+    async def dispatch(self, update, handler_type: type):
+        """Run the first matching handler of each group on the update, returns whether any handler matched."""
+        matched = False
+        try:
+            for group in self.groups.values():
+                for handler in group:
+                    if not isinstance(handler, handler_type):
+                        continue
+                    try:
+                        if not await handler.check(self, update):
+                            continue
+                    except Exception as e:
+                        logger.opt(exception=e).warning("Handler filter error:")
+                        continue
+                    matched = True
+                    try:
+                        if inspect.iscoroutinefunction(handler.callback):
+                            await handler.callback(self, update)
+                        else:
+                            await asyncio.to_thread(handler.callback, self, update)
+                    except StopPropagation:
+                        raise
+                    except ContinuePropagation:
+                        continue
+                    except Exception as e:
+                        logger.opt(exception=e).warning("Handler error:")
+                    break
+        except StopPropagation:
+            pass
+        return matched
+
+    async def call(self, method: str):
+        """Simulate an API call, flood waits are slept like pyrogram does below the sleep threshold."""
+        self.calls[method] += 1
+        telemetry.count("api_calls")
+        while True:
+            await asyncio.sleep(max(0.0, self.random.gauss(self.latency, self.jitter)))
+            if self.random.random() < self.flood_rate:
+                self.floods += 1
+                if self.flood_wait > self.sleep_threshold:
+                    raise FloodWait(value=self.flood_wait)
+                await asyncio.sleep(self.flood_wait)
+                continue
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                raise InternalServerError()
+            return
+
+    def message(self, chat_id: int, **kw):
+        return TM(
+            client=self,
+            id=next(self._ids),
+            chat=Chat(id=chat_id, type=ChatType.PRIVATE),
+            date=datetime.now(),
+            **kw,
+        )
+
+    def _deliver(self, chat_id: int, reply_markup=None, **kw):
+        message = self.message(chat_id, from_user=self.me, reply_markup=reply_markup, **kw)
+        self.delivered.setdefault(chat_id, []).append(message.id)
+        self.latest[chat_id] = message
+        if isinstance(reply_markup, InlineKeyboardMarkup):
+            self.menus[chat_id] = message
+        return message
+
+    async def send_message(self, chat_id: int, text: str, entities=None, reply_to_message_id: int = None, reply_markup=None, **kw):
+        await self.call("send_message")
+        return self._deliver(
+            chat_id, text=text, entities=entities, reply_to_message_id=reply_to_message_id, reply_markup=reply_markup
+        )
+
+    async def send_photo(self, chat_id: int, photo: str, caption: str = "", reply_markup=None, **kw):
+        await self.call("send_photo")
+        return self._deliver(chat_id, caption=caption, reply_markup=reply_markup)
+
+    async def send_cached_media(self, chat_id: int, file_id: str, caption: str = "", reply_to_message_id: int = None, **kw):
+        await self.call("send_cached_media")
+        return self._deliver(chat_id, caption=caption, reply_to_message_id=reply_to_message_id)
+
+    async def copy_message(self, chat_id: int, from_chat_id: int, message_id: int, caption: str = None, **kw):
+        await self.call("copy_message")
+        return self._deliver(chat_id, caption=caption)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, reply_markup=None, **kw):
+        await self.call("edit_message_text")
+        message = self.message(chat_id, text=text, reply_markup=reply_markup)
+        message.id = message_id
+        if isinstance(reply_markup, InlineKeyboardMarkup):
+            self.menus[chat_id] = message
+        elif chat_id in self.menus and self.menus[chat_id].id == message_id:
+            del self.menus[chat_id]
+        return message
+
+    async def answer_callback_query(self, callback_query_id: str, text: str = None, show_alert: bool = None, **kw):
+        await self.call("answer_callback_query")
+        return True
+
+    async def set_bot_commands(self, commands, **kw):
+        await self.call("set_bot_commands")
+        return True
+
+    async def get_users(self, user_ids):
+        await self.call("get_users")
+        if isinstance(user_ids, (int, str)):
+            return TU(id=int(user_ids), first_name=f"User {user_ids}", client=self)
+        return [TU(id=int(u), first_name=f"User {u}", client=self) for u in user_ids]
+
+    async def delete_messages(self, chat_id: int, message_ids, **kw):
+        await self.call("delete_messages")
+        ids = set(message_ids) if isinstance(message_ids, (list, tuple, set)) else {message_ids}
+        if chat_id in self.menus and self.menus[chat_id].id in ids:
+            del self.menus[chat_id]
+        return True
+
+    async def get_messages(self, chat_id: int, message_ids, **kw):
+        await self.call("get_messages")
+
+        def fetched(mid: int):
+            message = self.message(chat_id, text="message")
+            message.id = mid
+            return message
+
+        if isinstance(message_ids, int):
+            return fetched(message_ids)
+        return [fetched(mid) for mid in message_ids]
+
+    async def pin_chat_message(self, chat_id: int, message_id: int, **kw):
+        await self.call("pin_chat_message")
+        return True
+
+    async def unpin_chat_message(self, chat_id: int, message_id: int = 0, **kw):
+        await self.call("unpin_chat_message")
+        return True
@@ -0,0 +1,181 @@
+"""Microbenchmarks of model queries on the hot paths of group bots, run against a generated dataset."""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+import random
+import time
+from typing import Callable, List
+
+from pyrogram.types import User as TU
+
+from ..bot.fix import patch_pyrogram
+from ..model import (
+    BanGroup,
+    BanType,
+    Group,
+    Member,
+    MemberRole,
+    Message,
+    RedirectedMessage,
+    RedirectMap,
+    Statistic,
+    User,
+    UserRole,
+    db,
+    partitions,
+)
+from .common import QueryCounter, percentile, reset_database
+from .dataset import UID_BASE, insert
+
+
+def admin_statistics():
+    """Queries of the system info page in the father bot admin menu."""
+    date_ago = datetime.now() - timedelta(days=7)
+    return {
+        "groups": Group.select().where(~(Group.disabled)).count(),
+        "active_groups": Group.select().where(~(Group.disabled), Group.last_activity >= date_ago).count(),
+        "latest_user": User.select().order_by(User.created.desc()).get().id,
+        "users": User.select().count(),
+        "groupers": User.n_in_role(UserRole.GROUPER),
+        "awarded": User.n_in_role(UserRole.AWARDED),
+        "paying": User.n_in_role(UserRole.PAYING),
+        "admins": User.n_in_role(UserRole.ADMIN),
+        "avg_members": Group.get_avg_n_members(),
+        "messages": sum(Message.select().count() for _ in partitions.each()),
+    }
+
+
+def measure(name: str, func: Callable, args: list, counter: QueryCounter, setup: Callable = None, warm: bool = False):
+    """Time each call of func, with setup called untimed before each one, or all calls made once beforehand if warm."""
+    if warm:
+        for a in args:
+            func(a)
+    times = []
+    queries = 0
+    for a in args:
+        if setup:
+            setup()
+        count = counter.count
+        start = time.perf_counter()
+        func(a)
+        times.append(time.perf_counter() - start)
+        queries += counter.count - count
+    return {
+        "name": name,
+        "calls": len(args),
+        "mean": sum(times) / len(times),
+        "p50": percentile(times, 50),
+        "p99": percentile(times, 99),
+        "queries_per_call": queries / len(args),
+    }
+
+
+def run(path: Path, n: int = 1000, seed: int = 0) -> List[dict]:
+    rng = random.Random(seed)
+    reset_database(path)
+    patch_pyrogram()
+    counter = QueryCounter()
+
+    # Active members of the largest groups are hit most often, so sample by message.
+    message_ids = [m.id for m in Message.select(Message.id).order_by(Message.id.desc()).limit(n * 10)]
+    messages = [Message.get_by_id(i) for i in rng.sample(message_ids, min(n, len(message_ids)))]
+    group_members = {}
+    for m in messages:
+        if m.group_id not in group_members:
+            group_members[m.group_id] = [i for i, in Member.select(Member.id).where(Member.group == m.group_id, Member.role >= MemberRole.GUEST).tuples()]
+    members = [rng.choice(group_members[m.group_id]) for m in messages]
+    members = [Member.select(Member, Group, User).join_from(Member, Group).join_from(Member, User).where(Member.id == i).get() for i in members]
+    groups = [m.group for m in members]
+    tus = [TU(id=m.user.uid, first_name=m.user.firstname, username=m.user.username) for m in members]
+
+    def cold_roles():
+        User.role_cache.clear()
+
+    def cold_bans():
+        BanGroup.cache.clear()
+
+    results = [
+        measure("get_member", lambda i: tus[i].get_member(groups[i]), range(len(tus)), counter),
+        measure("validate (cold)", lambda m: m.validate(MemberRole.MEMBER), members, counter, setup=cold_roles),
+        measure("validate", lambda m: m.validate(MemberRole.MEMBER), members, counter, warm=True),
+        measure("check_ban (cold)", lambda m: m.check_ban(BanType.MESSAGE, fail=False), members, counter, setup=cold_bans),
+        measure("check_ban", lambda m: m.check_ban(BanType.MESSAGE, fail=False), members, counter, warm=True),
+        measure("get_redirect_for", lambda i: messages[i].get_redirect_for(members[i]), range(len(messages)), counter),
+        measure("not_redirected_messages", lambda m: m.not_redirected_messages(), members, counter),
+        measure("n_members", lambda g: g.n_members, groups, counter),
+        measure("admin_statistics (recount)", lambda _: admin_statistics(), range(max(1, n // 100)), counter),
+        measure("admin_statistics", lambda _: (Statistic.snapshot(), Group.get_avg_n_members()), range(max(1, n // 10)), counter),
+    ]
+    return results
+
+
+def large_group(path: Path, messages: int, members: int = 1000, n: int = 100, days: int = 365, seed: int = 0) -> List[dict]:
+    """
+    Catch-up queries of members in one group with a long history, which is inserted in bulk.
+    Half of the members send all messages, and each measured member of the other half has missed the latest few
+    messages. Redirections are only stored near the latest messages, since catch-up never reads past the first
+    redirected one.
+    """
+    rng = random.Random(seed)
+    now = datetime.now()
+    reset_database(path)
+    patch_pyrogram()
+    counter = QueryCounter()
+
+    with db.atomic():
+        insert(User, [User.id, User.uid, User.firstname], [(i + 1, UID_BASE + i, f"User {i}") for i in range(members)])
+        insert(BanGroup, [BanGroup.id, BanGroup.mask], [(1, 0)])
+        insert(
+            Group,
+            [Group.id, Group.uid, Group.token, Group.username, Group.creator, Group.default_ban_group, Group.member_count, Group.message_count],
+            [(1, UID_BASE * 2, "1:large", "large", 1, 1, members, messages)],
+        )
+        insert(
+            Member,
+            [Member.id, Member.group, Member.user, Member.role],
+            [(i + 1, 1, i + 1, MemberRole.CREATOR if i == 0 else MemberRole.MEMBER) for i in range(members)],
+        )
+        step = timedelta(days=days) / messages
+        senders = members // 2
+        for start in range(0, messages, 100000):
+            insert(
+                Message,
+                [Message.id, Message.group, Message.mid, Message.member, Message.mask, Message.pinned, Message.created],
+                [
+                    (i + 1, 1, i + 1, rng.randint(1, senders), "🎭", rng.random() < 0.0001, now - step * (messages - i))
+                    for i in range(start, min(start + 100000, messages))
+                ],
+                chunk=5000,
+            )
+
+    # Each measured member has missed up to 30 of the latest messages, and received the 100 messages before them.
+    lags = {m: rng.randint(0, 30) for m in range(senders + 1, members + 1)}
+    window = range(max(1, messages - 130), messages + 1)
+    received = {i: {} for i in window}
+    for m, lag in lags.items():
+        for i in window:
+            if messages - lag - 100 < i <= messages - lag:
+                received[i][m] = i
+    with db.atomic():
+        if RedirectMap.enabled():
+            insert(RedirectMap, [RedirectMap.message, RedirectMap.data], [(i, RedirectMap.pack(p)) for i, p in received.items()])
+        else:
+            insert(
+                RedirectedMessage,
+                [RedirectedMessage.mid, RedirectedMessage.message, RedirectedMessage.to_member],
+                [(r, i, m) for i, p in received.items() for m, r in p.items()],
+            )
+
+    group = Group.get_by_id(1)
+    latest = Message.get_by_id(messages)
+    sample = rng.sample(sorted(lags), min(n, len(lags)))
+    measured = [Member.get_by_id(m) for m in sample]
+    for m in measured:
+        m.group = group
+    joined = [Member(id=members + 1 + i, group=group, role=MemberRole.MEMBER) for i in range(n)]
+    return [
+        measure("large: not_redirected", lambda m: m.not_redirected_messages(), measured, counter),
+        measure("large: not_redirected (new)", lambda m: m.not_redirected_messages(), joined, counter),
+        measure("large: not_redirected_pinned", lambda m: m.not_redirected_pinned_messages(), measured[: max(1, n // 10)], counter),
+        measure("large: get_redirect_for", lambda m: latest.get_redirect_for(m), measured, counter),
+    ]
@@ -0,0 +1,369 @@
+"""
+Replay of update streams into real GroupBot and FatherBot handlers through fake clients.
+
+A trace is a JSON lines file of events:
+    {"t": 0.5, "bot": "group", "group": "1a2b3c4d", "kind": "message", "user": 1234, "text": "xxxx", "reply": false}
+where kind is "message", "edit", "command" or "callback", and callbacks name their target "menu".
+Traces are written by `Recorder` from running bots (contents are scrubbed and users pseudonymized), or made by `synthesize`.
+"""
+
+import asyncio
+from collections import Counter, defaultdict
+from datetime import datetime
+import hashlib
+import hmac
+import itertools
+import json
+from pathlib import Path
+import random
+import secrets
+import time
+from typing import Dict, List
+
+from loguru import logger
+from pyrogram.enums import ChatType
+from pyrogram.handlers import CallbackQueryHandler, EditedMessageHandler, MessageHandler
+from pyrogram.types import CallbackQuery as TC, Chat, Message as TM, User as TU
+
+from .. import telemetry
+from ..model import User, committer
+from .common import CacheCounter, LagMonitor, QueryCounter, percentile, reset_database
+from .fake import FakeClient
+
+# Menus which change group settings or memberships irreversibly, never clicked by synthetic users.
+UNSAFE_MENUS = {
+    "leave_group",
+    "kick_member",
+    "edit_member_role",
+    "embg_done",
+    "edbg_select",
+    "_edbg_done",
+    "retention_select",
+    "toggle_latest_message",
+    "delete_group",
+    "admin_delete_group",
+    "generate_codes",
+    "_ewmb_ok",
+}
+
+def pseudonym(uid: int, key: bytes):
+    """Keyed hash of a user id, which can not be reversed by hashing candidate ids without the key."""
+    return 10**6 + int(hmac.new(key, str(uid).encode(), hashlib.sha1).hexdigest(), 16) % 10**9
+
+
+class Recorder:
+    """Append scrubbed updates received by a bot to a trace file, enabled by "replay.record" in config."""
+
+    file = None
+    start: float = None
+    # Pseudonym key of the current recording, never written to the trace.
+    key: bytes = None
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.kind = "father" if bot.name == "father" else "group"
+
+    @classmethod
+    def attach(cls, bot, path: str):
+        if not cls.file:
+            cls.file = open(path, "a", buffering=1)
+            cls.start = time.time()
+            cls.key = secrets.token_bytes(32)
+            logger.warning(f'Updates are recorded to "{path}" for replaying.')
+        recorder = cls(bot)
+        bot.bot.add_handler(MessageHandler(recorder.on_message), group=-100)
+        bot.bot.add_handler(EditedMessageHandler(recorder.on_edit), group=-100)
+        bot.bot.add_handler(CallbackQueryHandler(recorder.on_callback), group=-100)
+        return recorder
+
+    def write(self, kind: str, user: TU, **kw):
+        if not user:
+            return
+        event = {"t": round(time.time() - self.start, 3), "bot": self.kind, "kind": kind, "user": pseudonym(user.id, self.key), **kw}
+        if self.kind == "group":
+            event["group"] = self.bot.name
+        self.file.write(json.dumps(event) + "\n")
+
+    async def on_message(self, client, message: TM):
+        text = message.text or message.caption or ""
+        if text.startswith("/"):
+            self.write("command", message.from_user, text=text.split()[0].split("@")[0])
+        else:
+            self.write("message", message.from_user, text="x" * len(text), reply=bool(message.reply_to_message_id))
+
+    async def on_edit(self, client, message: TM):
+        self.write("edit", message.from_user, text="x" * len(message.text or message.caption or ""))
+
+    async def on_callback(self, client, context: TC):
+        try:
+            menu = json.loads(self.bot.menu.database.get(context.data))["menu_id"]
+        except Exception:
+            menu = None
+        self.write("callback", context.from_user, menu=menu)
+
+
+def synthesize(users: int = 100, events: int = 1000, groups: int = 1, rate: float = 10.0, seed: int = 0) -> List[dict]:
+    """Make a trace of users chatting, editing, running commands and clicking menus, with Zipf-like activity."""
+    rng = random.Random(seed)
+    uids = [2 * 10**6 + i for i in range(users)]
+    # Each user chats in one group mostly, larger groups first.
+    homes = {u: min(groups - 1, int(rng.paretovariate(1.5)) - 1) for u in uids}
+    trace = []
+    weights = [1 / (i + 1) for i in range(users)]
+    mix = [("message", 0.7), ("edit", 0.05), ("command", 0.1), ("callback", 0.1), ("father", 0.05)]
+    t = 0.0
+    for _ in range(events):
+        t += rng.expovariate(rate)
+        u = rng.choices(uids, weights)[0]
+        kind = rng.choices([k for k, _ in mix], [w for _, w in mix])[0]
+        event = {"t": round(t, 3), "bot": "group", "group": homes[u], "kind": kind, "user": u}
+        if kind == "message":
+            event.update(text="x" * int(rng.paretovariate(1.2) * 20), reply=rng.random() < 0.2)
+        elif kind == "edit":
+            event.update(text="y" * int(rng.paretovariate(1.2) * 20))
+        elif kind == "command":
+            event.update(text=rng.choice(["/start", "/start", "/change", "/delete"]))
+        elif kind == "father":
+            del event["group"]
+            event.update(bot="father", kind=rng.choice(["command", "callback"]), text="/start")
+        trace.append(event)
+    return trace
+
+
+def load(path: Path) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(l) for l in f if l.strip()]
+
+
+def dump(trace: List[dict], path: Path):
+    with open(path, "w") as f:
+        for e in trace:
+            f.write(json.dumps(e) + "\n")
+
+
+class Replayer:
+    """Feed a trace into bots, each with its own fake client, and measure handler latency and load."""
+
+    def __init__(
+        self, workdir: Path, groups: int = 1, latency: float = 0.05, jitter: float = 0.02, workers: int = 128, seed: int = 0
+    ):
+        self.workdir = workdir
+        self.n_groups = groups
+        self.latency = latency
+        self.jitter = jitter
+        self.workers = asyncio.Semaphore(workers)
+        self.father = None
+        self.group_bots = []
+        self.group_keys: Dict[str, int] = {}
+        self.sent: Dict[tuple, TM] = {}
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.waits: List[float] = []
+        self.unmatched = 0
+        self.fallbacks = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.depths: List[int] = []
+        self.random = random.Random(seed)
+        self._ids = itertools.count(1)
+
+    def client(self, id: int, username: str, token: str):
+        me = TU(id=id, is_bot=True, first_name=username.capitalize(), username=username)
+        return FakeClient(self.latency, self.jitter, seed=id, me=me, bot_token=token)
+
+    async def setup(self):
+        from ..bot.fix import patch_pyrogram
+        from ..bot.father import FatherBot
+        from ..bot.group import GroupBot
+
+        reset_database(self.workdir / "replay.db")
+        patch_pyrogram()
+        telemetry.patch_clients()
+        creator = User.create(uid=10**6 - 1, firstname="Creator")
+        self.father = FatherBot("0:father")
+        self.father.bot = self.client(1, "fatherbot", "0:father")
+        await self.father.setup()
+        for i in range(self.n_groups):
+            token = f"{i + 1}:replay"
+            gb = GroupBot(token, creator=creator)
+            gb.bot = gb.queue._bot = self.client(i + 2, f"group{i}bot", token)
+            await gb.setup()
+            gb.start_worker()
+            self.group_bots.append(gb)
+
+    def target(self, event: dict):
+        if event["bot"] == "father":
+            return self.father
+        key = event.get("group", 0)
+        if isinstance(key, int):
+            return self.group_bots[key % self.n_groups]
+        if key not in self.group_keys:
+            self.group_keys[key] = len(self.group_keys) % self.n_groups
+        return self.group_bots[self.group_keys[key]]
+
+    def update(self, bot, event: dict):
+        """Build the update of an event, returns it with the handler type which receives it."""
+        client: FakeClient = bot.bot
+        uid = event["user"]
+        user = TU(id=uid, is_bot=False, first_name=f"User {uid}", client=client)
+        chat = Chat(id=uid, type=ChatType.PRIVATE, client=client)
+        kind = event["kind"]
+        if kind == "callback":
+            menu = client.menus.get(uid, None)
+            button = self.button(bot, menu, event.get("menu", None)) if menu else None
+            if button:
+                context = TC(client=client, id=str(next(self._ids)), from_user=user, chat_instance="0", message=menu, data=button)
+                return context, CallbackQueryHandler
+            # Users without a menu open one first.
+            self.fallbacks += 1
+            kind = "command"
+            event = {**event, "text": "/start"}
+        if kind == "edit":
+            original = self.sent.get((id(client), uid), None)
+            if not original:
+                self.fallbacks += 1
+                kind = "message"
+            else:
+                message = TM(
+                    client=client,
+                    id=original.id,
+                    chat=chat,
+                    from_user=user,
+                    date=original.date,
+                    edit_date=datetime.now(),
+                    text=event.get("text", "edited") or "edited",
+                )
+                return message, EditedMessageHandler
+        reply = None
+        if kind == "message" and event.get("reply", False):
+            reply = client.latest.get(uid, None)
+        elif kind == "command" and event.get("text", "") == "/delete":
+            reply = self.sent.get((id(client), uid), None)
+        message = TM(
+            client=client,
+            id=next(client._ids),
+            chat=chat,
+            from_user=user,
+            date=datetime.now(),
+            text=event.get("text", "") or "x",
+            reply_to_message=reply,
+            reply_to_message_id=reply.id if reply else None,
+            outgoing=False,
+        )
+        if kind == "message":
+            self.sent[(id(client), uid)] = message
+        return message, MessageHandler
+
+    def button(self, bot, menu: TM, target: str = None):
+        """Pick a callback button of the menu, the one leading to the target menu if possible."""
+        choices = {}
+        for row in menu.reply_markup.inline_keyboard:
+            for b in row:
+                if not b.callback_data or b.callback_data == "0":
+                    continue
+                try:
+                    menu_id = json.loads(bot.menu.database.get(b.callback_data))["menu_id"]
+                except Exception:
+                    continue
+                if menu_id in UNSAFE_MENUS:
+                    continue
+                choices[menu_id] = b.callback_data
+        if not choices:
+            return None
+        if target in choices:
+            return choices[target]
+        return self.random.choice(list(choices.values()))
+
+    async def dispatch(self, event: dict, scheduled: float):
+        bot = self.target(event)
+        update, handler_type = self.update(bot, event)
+        self.in_flight += 1
+        try:
+            async with self.workers:
+                start = time.perf_counter()
+                self.waits.append(start - scheduled)
+                if not await bot.bot.dispatch(update, handler_type):
+                    self.unmatched += 1
+                self.latencies[event["kind"]].append(time.perf_counter() - start)
+        finally:
+            self.in_flight -= 1
+
+    def depth(self):
+        return sum(len(gb.queue._list) + sum(m.running for m in gb.queue._metrics.values()) for gb in self.group_bots)
+
+    async def sample(self, interval: float = 0.1):
+        while True:
+            await asyncio.sleep(interval)
+            self.depths.append(self.depth())
+
+    def count_errors(self, message):
+        self.errors += 1
+
+    async def replay(self, trace: List[dict], speed: float = 1.0):
+        """Dispatch events at their trace times divided by speed, and wait for all handlers to finish."""
+        queries = QueryCounter()
+        cache = CacheCounter()
+        lag = LagMonitor()
+        sink = logger.add(self.count_errors, level="WARNING", filter=lambda r: "error" in r["message"].lower())
+        sampler = asyncio.create_task(self.sample())
+        lag.start()
+        tasks = []
+        loop = asyncio.get_running_loop()
+        trace = sorted(trace, key=lambda e: e["t"])
+        # Users of the trace join their groups before the timed part, as members of a running deployment.
+        joins = {(id(self.target(e)), e["user"]): e for e in trace if e["bot"] == "group"}
+        joins = [{**e, "kind": "command", "text": "/start"} for e in joins.values()]
+        await asyncio.gather(*[self.dispatch(e, time.perf_counter()) for e in joins])
+        self.latencies.clear()
+        self.waits.clear()
+        telemetry.handlers.clear()
+        queries.count = cache.count = 0
+        start = time.perf_counter()
+        begin = loop.time()
+        for e in trace:
+            delay = begin + e["t"] / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.dispatch(e, time.perf_counter())))
+        await asyncio.gather(*tasks)
+        spent = time.perf_counter() - start
+        committer.flush()
+        lag.stop()
+        sampler.cancel()
+        logger.remove(sink)
+        for gb in self.group_bots:
+            gb.worker_task.cancel()
+        n = len(tasks)
+        calls = sum((b.bot.calls for b in [self.father, *self.group_bots]), start=Counter())
+        return {
+            "events": n,
+            "seconds": spent,
+            "events_per_second": n / spent if spent else 0.0,
+            "latency": {
+                k: {"count": len(v), "p50": percentile(v, 50), "p99": percentile(v, 99), "max": max(v)}
+                for k, v in self.latencies.items()
+            },
+            "worker_wait_p99": percentile(self.waits, 99),
+            "queue_depth": {"p50": percentile(self.depths, 50), "p99": percentile(self.depths, 99), "max": max(self.depths, default=0)},
+            "queries_per_event": queries.count / n if n else 0.0,
+            "cache_ops_per_event": cache.count / n if n else 0.0,
+            "api_calls": dict(calls),
+            "unmatched": self.unmatched,
+            "fallbacks": self.fallbacks,
+            "errors": self.errors,
+            "loop_lag": lag.summary(),
+            "handlers": {name: stats.summary() for name, stats in telemetry.handlers.items()},
+        }
+
+
+async def run(
+    workdir: Path,
+    trace: List[dict],
+    groups: int = 1,
+    speed: float = 1.0,
+    latency: float = 0.05,
+    jitter: float = 0.02,
+    workers: int = 128,
+):
+    replayer = Replayer(workdir, groups=groups, latency=latency, jitter=jitter, workers=workers)
+    await replayer.setup()
+    return await replayer.replay(trace, speed=speed)
@@ -71,6 +71,14 @@ class Bot:
     async def setup(self):
         raise NotImplementedError()
 
+    def setup_recorder(self):
+        """Record received updates for load replaying if "replay.record" is set, see `anonyabbot.bench.replay`."""
+        path = config.get("replay.record", None)
+        if path:
+            from ..bench.replay import Recorder
+
+            Recorder.attach(self, path)
+
     async def info(self, info: str, context: Union[TM, TC], reply: bool = False, time: int = 5, block=True, alert: bool = False):
         async def doit(time, msg):
             await asyncio.sleep(time)
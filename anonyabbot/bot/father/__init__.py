@@ -22,6 +22,7 @@ class FatherBot(MenuBot, _Methods):
     name = "father"
 
     async def setup(self):
+        self.setup_recorder()
         self.bot.add_handler(MessageHandler(self.on_messagge))
         self.menu.setup(self.bot)
         await self.bot.set_bot_commands([BotCommand("start", "Open control panel")])
@@ -1,15 +1,16 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from textwrap import indent
 from pyrogram import Client
 from pyrogram.types import CallbackQuery as TC
 from pyrubrum import Element
-from peewee import fn
 
 import anonyabbot
 
-from ...utils import to_iterable, truncate_str
-from ...model import User, UserRole, Group, Member, Message
-from ..pool import start_time, worker_status, stop_group_bot
+from ... import telemetry
+from ...utils import format_size, to_iterable, truncate_str
+from ...model import User, UserRole, Group, Statistic
+from ...maintenance import wal_status
+from ..pool import start_time, worker_status, token_cls, scheduler, stop_group_bot
 from .common import operation
 
 
@@ -22,30 +23,80 @@ class Admin:
         context: TC,
         parameters: dict,
     ):
-        n_groups = Group.select().where(~(Group.disabled)).count()
-        date_ago = datetime.now() - timedelta(days=7)
-        n_active_groups = Group.select().where(~(Group.disabled), Group.last_activity >= date_ago).count()
-        latest_user: User = User.select().order_by(User.created.desc()).get()
+        stats = Statistic.snapshot()
+        latest_user: User = User.get_or_none(id=stats.get("latest_user", 0))
         running_time = ":".join(str(datetime.now() - start_time).split(":")[:3]).split('.')[0]
         waiting_delay = f"{worker_status['time'] / worker_status['requests']:.1f}" if worker_status['requests'] else "inf"
         msg = f"ℹ️ System info:\n\n"
         fields = [
-            f"Users: {User.select().count()}",
-            f"Groupers: {User.n_in_role(UserRole.GROUPER)}",
-            f"Awarded Users: {User.n_in_role(UserRole.AWARDED)}",
-            f"Paying Users: {User.n_in_role(UserRole.PAYING)}",
-            f"Admins: {User.n_in_role(UserRole.ADMIN)}",
-            f"Latest User: {latest_user.markdown}",
-            f"Groups: {n_groups}",
-            f"Active Groups: {n_active_groups}",
+            f"Users: {stats.get('users', 0)}",
+            f"Groupers: {stats.get(Statistic.role(UserRole.GROUPER), 0)}",
+            f"Awarded Users: {stats.get(Statistic.role(UserRole.AWARDED), 0)}",
+            f"Paying Users: {stats.get(Statistic.role(UserRole.PAYING), 0)}",
+            f"Admins: {stats.get(Statistic.role(UserRole.ADMIN), 0)}",
+            f"Latest User: {latest_user.markdown if latest_user else '-'}",
+            f"Groups: {stats.get('groups', 0)}",
+            f"Active Groups: {stats.get('active_groups', 0)}",
             f"Running Time: {running_time}",
             f"Average Delay: {waiting_delay} seconds",
+            f"Send Slots: {scheduler.running}/{scheduler.slots} ({scheduler.waiting} waiting)",
             f"Average Members: {Group.get_avg_n_members():.1f}",
-            f"Messages: {Message.select().count()}",
+            f"Messages: {stats.get('messages', 0)}",
         ]
+        if wal_status:
+            wal_size = sum(s["size"] for s in wal_status.values())
+            n_busy = sum(1 for s in wal_status.values() if s["busy"])
+            fields.append(f"WAL Size: {format_size(wal_size)} ({n_busy} busy)")
         msg += indent("\n".join(fields), "  ")
         return msg
 
+    @operation(UserRole.ADMIN)
+    async def on_api_stats(
+        self: "anonyabbot.FatherBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        api = telemetry.api
+        msg = f"📡 API calls since start: {api.calls} ({sum(api.errors.values())} errors)\n"
+        msg += f"FloodWait: {api.flood_wait.count} times, {api.flood_wait.sum:.0f} seconds\n\n"
+        busiest = api.busiest(8)
+        if busiest:
+            msg += "ℹ️ Busiest methods recently:\n"
+            for method, s in busiest:
+                mean = f"{s['mean'] * 1000:.0f}ms" if s["mean"] is not None else "-"
+                msg += f"  `{method}`: {s['recent']} calls, mean {mean}, {s['errors']} errors"
+                if s["flood_wait"]:
+                    msg += f", {s['flood_wait']:.0f}s flood wait"
+                msg += "\n"
+        usernames = {gb.name: gb.bot.me.username for gb in list(token_cls.values()) if gb.bot.me}
+        bots = sorted(api.bots.items(), key=lambda x: x[1], reverse=True)[:5]
+        if bots:
+            msg += "\nℹ️ Bots with most calls:\n"
+            for name, n in bots:
+                msg += f"  {'@' + usernames[name] if name in usernames else name}: {n}\n"
+        return msg
+
+    @operation(UserRole.ADMIN)
+    async def on_loop_stalls(
+        self: "anonyabbot.FatherBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        p99 = telemetry.loop_lag.quantile(0.99)
+        msg = f"🐢 Event loop lag p99: {f'{p99 * 1000:.0f}ms' if p99 is not None else '-'}\n\n"
+        stalls = list(telemetry.stalls)[-5:]
+        if not stalls:
+            return msg + "ℹ️ No stall since start."
+        msg += "ℹ️ Latest stalls:\n"
+        for s in reversed(stalls):
+            msg += f"\n{s.time.strftime('%m-%d %H:%M:%S')} | {s.lag:.2f}s in `{s.activity}`\n"
+            msg += "".join(f"  `{l}`\n" for l in s.stack[:4])
+        return msg
+
     @operation(UserRole.ADMIN)
     async def items_generate_codes_select_role(
         self: "anonyabbot.FatherBot",
@@ -115,11 +166,11 @@ class Admin:
             else:
                 groups = groups.order_by(Group.last_activity)
         else:
-            groups = Group.select(Group, fn.COUNT(Member.id).alias("num_members")).join(Member).group_by(Group.id)
+            groups = Group.select()
             if desc:
-                groups = groups.order_by(fn.Count(Member.id).desc())
+                groups = groups.order_by(Group.member_count.desc())
             else:
-                groups = groups.order_by(fn.Count(Member.id))
+                groups = groups.order_by(Group.member_count)
         items = []
         g: Group
         for i, g in enumerate(groups.iterator()):
@@ -215,12 +266,30 @@ class Admin:
         parameters: dict,
     ):
         group: Group = Group.get_by_id(parameters["group_id"])
+        gb = token_cls.get(group.token, None)
+        queue_spec = wait_spec = send_wait_spec = "<unknown>"
+        if gb and gb.name in scheduler.stats:
+            stats = scheduler.stats[gb.name]
+            send_wait_spec = f"{stats['wait'] / stats['requests']:.2f}s (max {stats['max_wait']:.1f}s)"
+        if not gb:
+            memory_spec = "<not running>"
+        elif gb.hibernated:
+            memory_spec = f"{format_size(sum(gb.memory_usage().values()))} (hibernated, {format_size(gb.hibernation_saved)} saved)"
+        else:
+            memory_spec = format_size(sum(gb.memory_usage().values()))
+            metrics = gb.queue.metrics()
+            queue_spec = ", ".join(f"{p.display} {m['queued']}+{m['running']}" for p, m in metrics.items())
+            wait_spec = ", ".join(f"{p.display} {m['wait'] / m['processed'] if m['processed'] else 0:.1f}s" for p, m in metrics.items())
         msg = f"ℹ️ Group info:\n\n"
         fields = [
             f"Title: [{group.title}](t.me/{group.username})",
             f"Creator: {group.creator.markdown}",
             f"Members: {group.n_members}",
             f"Messages: {group.n_messages}",
+            f"Memory: {memory_spec}",
+            f"Queue (waiting+running): {queue_spec}",
+            f"Average Wait: {wait_spec}",
+            f"Send Slot Wait: {send_wait_spec}",
             f"Disabled: {'**Yes**' if group.disabled else 'No'}",
             f"Created: {group.created.strftime('%Y-%m-%d')}",
             f"Last Activity: {group.last_activity.strftime('%Y-%m-%d')}",
@@ -252,8 +321,7 @@ class Admin:
         parameters: dict,
     ):
         group: Group = Group.get_by_id(parameters["group_id"])
-        group.disabled = True
-        group.save()
+        group.disable()
         await stop_group_bot(group.token)
         await context.answer("✅ Succeed")
         await self.to_menu("_group_detail_admin", context)
@@ -7,6 +7,7 @@ from pyrogram.types import Message as TM, CallbackQuery as TC
 import anonyabbot
 
 from ...model import OperationError, UserRole, User
+from ...telemetry import instrument
 
 
 def operation(req: UserRole = None, prohibited: UserRole = UserRole.BANNED, conversation=False):
@@ -40,6 +41,6 @@ def operation(req: UserRole = None, prohibited: UserRole = UserRole.BANNED, conv
                 await self.info(f"⚠️ Error occured.", context=context, alert=True)
                 return False
 
-        return wrapper
+        return instrument(f"father.{func.__name__}")(wrapper)
 
     return deco
@@ -207,7 +207,6 @@ class Start:
     ):
         group: Group = Group.get_by_id(parameters["group_id"])
         await stop_group_bot(group.token)
-        group.disabled = True
-        group.save()
+        group.disable()
         await context.answer("✅ Group deleted.")
         await self.to_menu("list_group", context)
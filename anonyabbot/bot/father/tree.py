@@ -42,6 +42,8 @@ class Tree:
                     "ℹ️ All Groups:",
                     extras=["_lga_switch_activity", "_lga_switch_member"],
                 ): {M("jump_group_detail_admin")},
+                M("api_stats", "📡 API Calls"): None,
+                M("loop_stalls", "🐢 Loop Stalls"): None,
             },
             K("_generate_codes_select_days", display="ℹ️ Select Time", items=[30, 60, 90, 180, 360, 1080, 3600]): {
                 K("generate_codes_select_num", display="ℹ️ Select Quantity", items=[1, 5, 10, 20]): {M("generate_codes", back="admin")}
@@ -1,6 +1,14 @@
+import asyncio
+import time
+
 from loguru import logger
+from pyrogram import Client, raw
+from pyrogram.errors import FloodWait, RPCError
+from pyrogram.raw.core import TLObject
+from pyrogram.session import Session
 from pyrogram.types import User as TU
 
+from .. import telemetry
 from ..model import db, User, Group, UserRole
 
 
@@ -39,3 +47,47 @@ def patch_pyrogram():
     setattr(TU, "name", property(name))
     setattr(TU, "get_record", get_record)
     setattr(TU, "get_member", get_member)
+
+
+def method_name(query: TLObject):
+    if isinstance(query, (raw.functions.InvokeWithoutUpdates, raw.functions.InvokeWithTakeout)):
+        query = query.query
+    return ".".join(query.QUALNAME.split(".")[1:])
+
+
+def patch_invoke():
+    """
+    Instrument raw Telegram API calls, counting them by method and by bot with their latency and RPC errors.
+    FloodWaits are recorded at session level, so that those slept through by pyrogram are also seen.
+    """
+    if getattr(Client.invoke, "instrumented", False):
+        return
+
+    invoke = Client.invoke
+    send = Session.send
+
+    async def instrumented_invoke(self: Client, query: TLObject, *args, **kw):
+        telemetry.count("api_calls")
+        error = None
+        start = time.perf_counter()
+        try:
+            return await invoke(self, query, *args, **kw)
+        except RPCError as e:
+            error = e.ID or type(e).__name__
+            raise
+        except (OSError, asyncio.TimeoutError) as e:
+            error = type(e).__name__
+            raise
+        finally:
+            telemetry.api.call(method_name(query), self.name, time.perf_counter() - start, error)
+
+    async def instrumented_send(self: Session, data: TLObject, *args, **kw):
+        try:
+            return await send(self, data, *args, **kw)
+        except FloodWait as e:
+            telemetry.api.flood(method_name(data), e.value)
+            raise
+
+    instrumented_invoke.instrumented = True
+    setattr(Client, "invoke", instrumented_invoke)
+    setattr(Session, "send", instrumented_send)
@@ -7,14 +7,16 @@ from pyrogram import filters
 from pyrogram.handlers import MessageHandler, EditedMessageHandler
 from pyrogram.errors import UserDeactivated, RPCError
 from pyrogram.types import BotCommand
+from pyrubrum import DictDatabase
 
-from ...utils import truncate_str
+from ...utils import sizeof, format_size, truncate_str
+from ...telemetry import DeliveryStats
 from ...cache import CacheDict
 from ...config import config
-from ...model import UserRole, db, BanGroup, Group, User, Member, MemberRole
+from ...model import UserRole, db, partitions, committer, BanGroup, Group, User, Member, MemberRole
 from ..base import MenuBot
 from .mask import UniqueMask
-from .worker import Worker, WorkerQueue
+from .worker import Worker, WorkerQueue, Lanes, Operation
 from .on_message import OnMessage
 from .command import OnCommand
 from .tree import Tree
@@ -37,6 +39,7 @@ class GroupBot(MenuBot, _Methods):
         self.lock = asyncio.Lock()
         self.user_locks: Dict[Member, asyncio.Lock] = {}
         self.queue = WorkerQueue(f'group.{self.token}.worker.queue', self.bot)
+        self.lanes = Lanes()
         self.worker_status = CacheDict(
             f'group.{self.token}.worker.status',
             default={
@@ -45,7 +48,11 @@ class GroupBot(MenuBot, _Methods):
                 'errors': 0
             }
         )
-        self.jobs.append(self.worker())
+        self.delivery = DeliveryStats()
+        self.active_ops: Dict[int, Operation] = {}
+        self.worker_task: asyncio.Task = None
+        self.hibernated = False
+        self.hibernation_saved = 0
         self.group: Group = Group.get_or_none(token=self.token)
         if self.group:
             self.creator = self.group.creator
@@ -60,13 +67,14 @@ class GroupBot(MenuBot, _Methods):
             except Exception as e:
                 if isinstance(e, UserDeactivated):
                     if self.group:
-                        self.group.disabled = True
-                        self.group.save()
+                        self.group.disable()
                         logger.info(f"Group @{self.group.username} disabled because token deactivated.")
                 self.boot_exception = e
                 return
             finally:
                 self.tasks.extend([asyncio.create_task(j) for j in self.jobs])
+                self.tasks.append(asyncio.create_task(self.status_reporter()))
+                self.start_worker()
                 self.booted.set()
             await self.failed.wait()
         except asyncio.CancelledError:
@@ -87,6 +95,7 @@ class GroupBot(MenuBot, _Methods):
                     logger.info(f"Stop listening updates in group with token {truncate_str(self.token, 20)}.")
 
     async def setup(self):
+        self.setup_recorder()
         common_filter = filters.private & (~filters.outgoing) & (~filters.bot) & (~filters.service)
         self.bot.add_handler(MessageHandler(self.on_message, common_filter))
         self.bot.add_handler(EditedMessageHandler(self.on_edit_message, common_filter))
@@ -140,9 +149,65 @@ class GroupBot(MenuBot, _Methods):
             ]
         )
 
-    async def touch(self):
+    def touch(self):
         if self.group:
             self.group.username = self.bot.me.username
             self.group.title = self.bot.me.name
-            self.group.save()
-            self.group.touch()
\ No newline at end of file
+            committer.submit(self.group.touch)
+
+    def start_worker(self):
+        self.worker_task = asyncio.create_task(self.worker())
+        self.tasks.append(self.worker_task)
+
+    def memory_usage(self):
+        """Estimate memory (in bytes) held by the structures which are released in hibernation."""
+        seen = {id(self.bot), id(asyncio.get_event_loop())}
+        usage = {
+            "conversation": sizeof(self.conversation, seen),
+            "user_locks": sizeof(self.user_locks, seen),
+            "masks": sizeof(self.unique_mask_pool.users._cache, seen) + sizeof(self.unique_mask_pool.masks._cache, seen),
+            "queue": sizeof(self.queue._list, seen),
+            "worker_status": sizeof(self.worker_status._cache, seen),
+            "worker": sizeof(self.worker_task, seen) if self.worker_task else 0,
+        }
+        if isinstance(self.menu.database, DictDatabase):
+            usage["menu"] = sizeof(dict(self.menu.database), seen)
+        return usage
+
+    async def hibernate(self):
+        """Release in-memory structures of an idle group, which will be rebuilt on next update."""
+        if self.hibernated:
+            return False
+        async with self.lock:
+            if any(l.locked() for l in self.user_locks.values()):
+                return False
+            before = sum(self.memory_usage().values())
+            if not self.queue.unload():
+                return False
+            if self.worker_task:
+                self.worker_task.cancel()
+                self.tasks.remove(self.worker_task)
+                self.worker_task = None
+            self.conversation.clear()
+            self.user_locks.clear()
+            await self.unique_mask_pool.unload()
+            self.worker_status.unload()
+            if isinstance(self.menu.database, DictDatabase):
+                self.menu.database.clear()
+            partitions.close(self.group.id)
+            self.group.forget_caches()
+            self.hibernated = True
+            self.hibernation_saved = before - sum(self.memory_usage().values())
+        logger.info(f"Group @{self.group.username} hibernated, {format_size(self.hibernation_saved)} released.")
+        return True
+
+    async def wake(self):
+        if not self.hibernated:
+            return
+        async with self.lock:
+            if not self.hibernated:
+                return
+            self.start_worker()
+            self.hibernated = False
+            self.hibernation_saved = 0
+        logger.info(f"Group @{self.group.username} waked up from hibernation.")
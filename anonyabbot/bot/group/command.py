@@ -8,7 +8,7 @@ from pyrubrum import Element
 
 import anonyabbot
 
-from ...model import MemberRole, Member, OperationError, BanType, Message, PMBan, PMMessage, RedirectedMessage, User
+from ...model import MemberRole, Member, OperationError, BanType, Message, PMBan, PMMessage, User
 from ...utils import async_partial, parse_timedelta
 from .common import operation
 from .worker import DeleteOperation
@@ -23,17 +23,16 @@ class OnCommand:
             raise OperationError("no message replied")
         mr: Message = Message.get_or_none(mid=rm.id, member=member)
         if not mr:
-            rmr = RedirectedMessage.get_or_none(mid=rm.id, to_member=member)
-            if rmr:
-                mr: Message = rmr.message
-            else:
+            mr: Message = Message.from_redirect(member, rm.id)
+            if not mr:
                 if allow_pm:
                     pmm: PMMessage = PMMessage.get_or_none(redirected_mid=rm.id, to_member=member)
                     if pmm:
                         mr: PMMessage = pmm
-                    else:
-                        raise OperationError("this is not a anonymous message or is outdated")
-                else:
+                if not mr:
+                    cutoff = self.group.retention_cutoff()
+                    if cutoff and rm.date and rm.date < cutoff:
+                        raise OperationError("this message has expired")
                     raise OperationError("this is not a anonymous message or is outdated")
         return member, mr
 
@@ -43,6 +42,8 @@ class OnCommand:
         info = async_partial(self.info, context=message)
         member, mr = self.get_member_reply_message(message)
         member.check_ban(BanType.MESSAGE)
+        if mr.expired:
+            raise OperationError("this message has expired and can not be revoked")
         if not mr.member.id == member.id:
             if not member.validate(MemberRole.ADMIN_BAN):
                 return await info(f"⚠️ Only messages sent by you can be deleted.")
@@ -110,8 +111,7 @@ class OnCommand:
         if target.role == MemberRole.BANNED:
             return await info("⚠️ The user is already banned.")
 
-        target.role = MemberRole.BANNED
-        target.save()
+        target.set_role(MemberRole.BANNED)
         return await info("🚫 Member banned.")
 
     @operation()
@@ -150,8 +150,7 @@ class OnCommand:
         if not target.role == MemberRole.BANNED:
             return await info("⚠️ The user is not banned.")
 
-        target.role = MemberRole.GUEST
-        target.save()
+        target.set_role(MemberRole.GUEST)
         return await info("✅ Member unbanned.")
 
     @operation(MemberRole.ADMIN_BAN)
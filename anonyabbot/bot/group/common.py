@@ -8,7 +8,8 @@ from pyrogram.errors import UserDeactivated, MessageNotModified
 
 import anonyabbot
 from ...utils import nonblocking
-from ...model import OperationError, MemberRole, Member, User
+from ...telemetry import instrument
+from ...model import OperationError, MemberRole, Member, User, partitions, committer
 
 
 def operation(req: MemberRole = MemberRole.GUEST, conversation=False, allow_disabled=False, touch=True, concurrency='inf'):
@@ -26,8 +27,11 @@ def operation(req: MemberRole = MemberRole.GUEST, conversation=False, allow_disa
                 else:
                     raise ValueError("wrong number of arguments")
                 try:
+                    await self.wake()
+                    if self.group:
+                        partitions.bind(self.group.id)
                     if touch:
-                        await self.touch()
+                        self.touch()
                     if not conversation:
                         self.set_conversation(context, status=None)
                     if (not allow_disabled) and self.group.disabled:
@@ -37,7 +41,7 @@ def operation(req: MemberRole = MemberRole.GUEST, conversation=False, allow_disa
                         if not member:
                             raise OperationError("you are not in this group")
                         member.validate(req, fail=True)
-                        member.touch()
+                        committer.submit(member.touch)
                     if not concurrency == 'inf':
                         user: User = context.from_user.get_record()
                         async with self.lock:
@@ -75,11 +79,10 @@ def operation(req: MemberRole = MemberRole.GUEST, conversation=False, allow_disa
                         pass
             except UserDeactivated as e:
                 if self.group:
-                    self.group.disabled = True
-                    self.group.save()
+                    self.group.disable()
                 self.failed.set()
                 logger.info(f"Group @{client.me.username} disabled because token deactivated.")
 
-        return wrapper
+        return instrument(f"group.{func.__name__}")(wrapper)
 
     return deco
@@ -38,8 +38,8 @@ class Manage:
         group = self.group
         member: Member = context.from_user.get_member(self.group)
         creator = group.creator.markdown if member.role >= MemberRole.ADMIN_BAN else group.creator.masked_name
-        if self.worker_status['requests']:
-            estimated_delay = self.worker_status['time'] / self.worker_status['requests'] * group.n_members
+        estimated_delay = self.estimated_delay()
+        if estimated_delay is not None:
             estimated_delay_spec = f"{estimated_delay:.1f} seconds"
         else:
             estimated_delay_spec = "<unknown>"
@@ -116,7 +116,8 @@ class Manage:
             original = self.group.default_ban_group
             self.group.default_ban_group = BanGroup.generate(types)
             self.group.save()
-            original.delete_instance()
+            original.delete_instance(recursive=True)
+        BanGroup.invalidate(original.id)
         await context.answer("✅ Succeed.")
         await self.to_menu("_group_details", context)
 
@@ -247,6 +248,53 @@ class Manage:
         )
         return msg
 
+    @operation(MemberRole.ADMIN_ADMIN)
+    async def on_edit_retention(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        if self.group.retention_days is None:
+            current = "system default"
+        elif self.group.retention_days:
+            current = f"{self.group.retention_days} days"
+        else:
+            current = "forever"
+        return (
+            f"🗄️ Messages are currently kept for: {current}.\n\n"
+            "ℹ️ Expired messages can no longer be replied, edited or revoked.\n\n"
+            "⬇️ Select how long messages are kept:"
+        )
+
+    @operation(MemberRole.ADMIN_ADMIN)
+    async def items_edit_retention(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        items = [Element(f"{d} days", str(d)) for d in [7, 30, 90, 180, 365]]
+        items.append(Element("Forever", "0"))
+        items.append(Element("Default", "-1"))
+        return items
+
+    @operation(MemberRole.ADMIN_ADMIN)
+    async def on_retention_select(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        days = int(parameters["retention_select_id"])
+        self.group.retention_days = None if days < 0 else days
+        self.group.save()
+        await context.answer("✅ Succeed.")
+        await self.to_menu("_group_details", context)
+
     @operation(MemberRole.ADMIN_BAN)
     async def on_list_group_members(
         self: "anonyabbot.GroupBot",
@@ -402,8 +450,7 @@ class Manage:
         if target.role >= member.role:
             await context.answer("⚠️ Permission Denied.", show_alert=True)
             await self.to_menu("_member_detail", context)
-        target.role = role
-        target.save()
+        target.set_role(role)
         await context.answer("✅ Changed.")
         await self.to_menu("_member_detail", context)
 
@@ -434,7 +481,8 @@ class Manage:
             current_selection = None
         if not current_selection:
             if target.ban_group:
-                parameters["embg_current"] = current_selection = [t.type.value for t in target.ban_group.entries.iterator()]
+                mask, _ = BanGroup.lookup(target.ban_group_id)
+                parameters["embg_current"] = current_selection = [t.value for t in BanType.from_mask(mask)]
             else:
                 parameters["embg_current"] = current_selection = [t.value for t in self.group.default_bans()]
 
@@ -509,7 +557,9 @@ class Manage:
             target.ban_group = BanGroup.generate(types, until=until)
             target.save()
             if original:
-                original.delete_instance()
+                original.delete_instance(recursive=True)
+        if original:
+            BanGroup.invalidate(original.id)
         await context.answer("✅ Succeed.")
         await self.to_menu("_member_detail", context)
 
@@ -548,8 +598,7 @@ class Manage:
         if target.role >= member.role:
             await context.answer("⚠️ Permission Denied.", show_alert=True)
             await self.to_menu("_member_detail", context)
-        target.role = MemberRole.BANNED
-        target.save()
+        target.set_role(MemberRole.BANNED)
         await context.answer("✅ Succeed.")
         await self.to_menu("list_group_members", context)
 
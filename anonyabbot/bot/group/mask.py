@@ -32,6 +32,12 @@ class UniqueMask:
         self.users.save()
         self.masks.save()
 
+    async def unload(self):
+        async with self.lock:
+            self.save()
+            self.users.unload()
+            self.masks.unload()
+
     async def take_mask(self, member: Member, role: str):
         async with self.lock:
             if role in self.masks:
@@ -10,42 +10,50 @@ from pyrogram.errors import MessageDeleteForbidden
 import anonyabbot
 
 from ...utils import async_partial
-from ...model import Member, BanType, MemberRole, Message, PMMessage, RedirectedMessage, OperationError, User
+from ...model import Member, BanType, MemberRole, Message, PMMessage, OperationError, User, committer
 from .common import operation
 from .mask import MaskNotAvailable
 from .worker import BroadcastOperation, EditOperation
 
 
+LINK_PATTERN = re.compile(
+    r"(https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|www\.[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9]+\.[^\s]{2,}|www\.[a-zA-Z0-9]+\.[^\s]{2,})"
+)
+LINK_ENTITIES = {
+    MessageEntityType.URL,
+    MessageEntityType.TEXT_LINK,
+    MessageEntityType.MENTION,
+    MessageEntityType.TEXT_MENTION,
+}
+
+
+def classify_message(message: TM):
+    """Get the mask of ban types which sending the message requires."""
+    mask = BanType.MESSAGE.bit
+    if message.media:
+        mask |= BanType.MEDIA.bit
+    if message.sticker:
+        mask |= BanType.STICKER.bit
+    if message.reply_markup:
+        mask |= BanType.MARKUP.bit
+    if message.entities and any(e.type in LINK_ENTITIES for e in message.entities):
+        mask |= BanType.LINK.bit
+    content = message.text or message.caption
+    if content:
+        if len(content) > 200:
+            mask |= BanType.LONG.bit
+        if not mask & BanType.LINK.bit:
+            # Every match contains "http" or "www.", so the regex is skipped for most messages.
+            if ("http" in content or "www." in content) and LINK_PATTERN.search(content):
+                mask |= BanType.LINK.bit
+    return mask
+
+
 class OnMessage:
-    def check_message(self, message: Message, member: Member):
+    def check_message(self, message: TM, member: Member):
         member.validate(MemberRole.LEFT, fail=True, reversed=True)
-        member.check_ban(BanType.MESSAGE)
-        if message.media:
-            member.check_ban(BanType.MEDIA)
-        if message.sticker:
-            member.check_ban(BanType.STICKER)
-        if message.reply_markup:
-            member.check_ban(BanType.MARKUP)
-        if message.entities:
-            for e in message.entities:
-                if e.type in [
-                    MessageEntityType.URL,
-                    MessageEntityType.TEXT_LINK,
-                    MessageEntityType.MENTION,
-                    MessageEntityType.TEXT_MENTION,
-                ]:
-                    member.check_ban(BanType.LINK)
-        content = message.text or message.caption
-        if content:
-            if len(content) > 200:
-                member.check_ban(BanType.LONG)
-            if re.search(
-                r"(https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|www\.[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9]+\.[^\s]{2,}|www\.[a-zA-Z0-9]+\.[^\s]{2,})",
-                content,
-            ):
-                member.check_ban(BanType.LINK)
-        
-    
+        member.check_bans(classify_message(message))
+
     @operation(conversation=True)
     async def on_chat_instruction(
         self: "anonyabbot.GroupBot",
@@ -169,8 +177,8 @@ class OnMessage:
                     await imsg.delete()
                     await message.delete()
                     return
-            member.role = MemberRole.MEMBER
-            member.save()
+            # Committed together with the message record below, in submission order.
+            committer.submit(member.set_role, MemberRole.MEMBER)
 
         if member.pinned_mask:
             mask = member.pinned_mask
@@ -188,20 +196,27 @@ class OnMessage:
         if rm:
             rmm: Message = Message.get_or_none(mid=rm.id, member=member)
             if not rmm:
-                rmr = RedirectedMessage.get_or_none(mid=rm.id, to_member=member)
-                if rmr:
-                    rmm: Message = rmr.message
-                else:
+                rmm: Message = Message.from_redirect(member, rm.id)
+                if not rmm:
                     pmm: PMMessage = PMMessage.get_or_none(redirected_mid=rm.id, to_member=member)
                     if pmm:
                         await self.pm(message)
                         return
+            cutoff = self.group.retention_cutoff()
+            if (rmm and rmm.expired) or ((not rmm) and cutoff and rm.date and rm.date < cutoff):
+                await binfo("⚠️ Sorry, the replied message has expired, and this message will be deleted soon.", time=30)
+                await message.delete()
+                return
         else:
             rmm = None
                 
-        m = Message.create(group=self.group, mid=message.id, member=member, mask=mask, reply_to=rmm)
-        member.last_mask = mask
-        member.save()
+        def record():
+            m = Message.create(group=self.group, mid=message.id, member=member, mask=mask, reply_to=rmm)
+            member.last_mask = mask
+            member.save()
+            return m
+
+        m: Message = await committer.run(record)
 
         e = asyncio.Event()
         op = BroadcastOperation(context=message, member=member, finished=e, message=m)
@@ -242,6 +257,9 @@ class OnMessage:
         mr = Message.get_or_none(mid=message.id)
         if not mr:
             return
+        if mr.expired:
+            await self.info("⚠️ Sorry, this message has expired, and the edition will not be broadcasted.", context=message, block=False)
+            return
         e = asyncio.Event()
         op = EditOperation(context=message, member=member, finished=e, message=mr)
         await self.queue.put(op)
@@ -66,7 +66,7 @@ class Start:
             nrpm = member.not_redirected_pinned_messages()
             if len(nrpm) > 0:
                 e = asyncio.Event()
-                op = BulkRedirectOperation(messages=reversed(nrpm), member=member, finished=e)
+                op = BulkRedirectOperation(messages=list(reversed(nrpm)), member=member, finished=e)
                 info = async_partial(self.info, context=context)
                 msg: TM = await info(f"🔃 Loading pinned messages ...", time=None)
                 await self.queue.put(op)
@@ -78,7 +78,7 @@ class Start:
                 await msg.delete()
             
                 e = asyncio.Event()
-                op = BulkPinOperation(messages=reversed(list(member.pinned_messages())), member=member, finished=e)
+                op = BulkPinOperation(messages=list(reversed(list(member.pinned_messages()))), member=member, finished=e)
                 info = async_partial(self.info, context=context)
                 msg: TM = await info(f"🔃 Pinning messages ...", time=None)
                 await self.queue.put(op)
@@ -92,7 +92,7 @@ class Start:
             nrm = member.not_redirected_messages()
             if len(nrm) > 0:
                 e = asyncio.Event()
-                op = BulkRedirectOperation(messages=reversed(nrm), member=member, finished=e)
+                op = BulkRedirectOperation(messages=list(reversed(nrm)), member=member, finished=e)
                 info = async_partial(self.info, context=context)
                 msg: TM = await info(f"🔃 Loading latest messages ...", time=None)
                 await self.queue.put(op)
@@ -131,8 +131,7 @@ class Start:
                 await context.delete()
             mask = member.pinned_mask or await self.unique_mask_pool.mask_for(member)
             if member.role == MemberRole.LEFT:
-                member.role = MemberRole.GUEST
-                member.save()
+                member.set_role(MemberRole.GUEST)
                 await welcome(self, user, member, context)
             else:
                 return (
@@ -173,8 +172,7 @@ class Start:
         parameters: dict,
     ):
         member: Member = context.from_user.get_member(self.group)
-        member.role = MemberRole.LEFT
-        member.save()
+        member.set_role(MemberRole.LEFT)
         await context.answer("✅ You have left the group and will no longer receive messages.", show_alert=True)
         await asyncio.sleep(2)
         await context.message.delete()
@@ -37,6 +37,7 @@ class Tree:
                     M("toggle_latest_message"): None,
                 },
                 M("edit_chat_instruction", "🧾 Chatting Instruction"): None,
+                K("edit_retention", "🗄️ Message Retention", per_line=3): {M("retention_select")},
                 P("list_group_members", "👤 Members", extras=["_lgm_switch_activity", "_lgm_switch_role"]): {M("jump_member_detail")},
                 M("close_group_details", "❌ Close"): None,
             },
@@ -1,18 +1,40 @@
 import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
 import copy
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List
+import time
+from types import FrameType
+from typing import Callable, Coroutine, Deque, Dict, Iterable, List
 
+from aenum import IntEnum
 from pyrogram.types import Message as TM, MessageEntity
 from pyrogram.errors import RPCError, UserIsBlocked, UserDeactivated
 
 import anonyabbot
 
-from ...cache import CacheQueue
-from ...model import MemberRole, Message, Member, BanType, RedirectedMessage
+from ... import telemetry
+from ...cache import Cache, CacheQueue
+from ...config import config
+from ...utils import Def, batch, to_iterable
+from ...model import MemberRole, Message, Member, BanType, partitions, committer
 from .. import pool
 
+
+class Priority(IntEnum):
+    _init_ = "value display concurrency"
+
+    DELETE = 0, "delete", 2
+    EDIT = 1, "edit", 2
+    BROADCAST = 2, "broadcast", 4
+    CATCHUP = 3, "catch-up", 4
+
+    @property
+    def budget(self):
+        return int(config.get(f"worker.concurrency.{self.name.lower()}", self.concurrency))
+
+
 @dataclass(kw_only=True)
 class Operation:
     member: Member
@@ -21,38 +43,134 @@ class Operation:
     errors: int = 0
     created: datetime = field(default_factory=datetime.now)
 
+    priority = Priority.BROADCAST
+
+    @property
+    def key(self):
+        """Operations sharing the same key are processed in order of submission."""
+        message = getattr(self, "message", None)
+        return message.id if message else None
+
 
 @dataclass(kw_only=True)
 class BroadcastOperation(Operation):
     context: TM
     message: Message
 
+    priority = Priority.BROADCAST
+
 
 @dataclass(kw_only=True)
 class EditOperation(Operation):
     context: TM
     message: Message
 
+    priority = Priority.EDIT
+
 
 @dataclass(kw_only=True)
 class DeleteOperation(Operation):
     message: Message
 
+    priority = Priority.DELETE
+
+
 @dataclass(kw_only=True)
 class BulkRedirectOperation(Operation):
     messages: List[Message]
-    
+
+    priority = Priority.CATCHUP
+
+
 @dataclass(kw_only=True)
 class BulkPinOperation(Operation):
     messages: List[Message]
 
+    priority = Priority.CATCHUP
+
+
+def describe_frame(frame: FrameType):
+    """Name the worker operation that a frame of this module is processing, for loop stall reports."""
+    if frame.f_globals is not globals():
+        return None
+    op = frame.f_locals.get("op", None)
+    if isinstance(op, Operation):
+        return f"worker.{type(op).__name__}"
+
+
+telemetry.activities.append(describe_frame)
+
+
+@dataclass
+class QueueMetrics:
+    running: int = 0
+    processed: int = 0
+    requests: int = 0
+    errors: int = 0
+    wait: float = 0
+    time: float = 0
+
+
 class WorkerQueue(CacheQueue):
-    __noproxy__ = ("_bot",)
-    
+    """
+    A cached queue of operations, scheduled by priority classes.
+    Each class has its own concurrency budget, and operations on the same message keep their submission order.
+    Queued operations are indexed by priority and by key, while the list in cache keeps the submission order.
+    """
+
+    __noproxy__ = ("_bot", "_cond", "_active", "_started", "_metrics", "_queues", "_keyed", "_stops", "_budgets", "_revision")
+
     def __init__(self, path=None, bot=None):
         super().__init__(path)
         self._bot = bot
-    
+        self._cond = asyncio.Condition()
+        self._active: Dict[int, int] = {}
+        self._started: Dict[int, datetime] = {}
+        self._metrics: Dict[Priority, QueueMetrics] = {p: QueueMetrics() for p in Priority}
+        self._queues: Dict[Priority, Deque[Operation]] = {p: deque() for p in Priority}
+        self._keyed: Dict[int, Deque[Operation]] = {}
+        self._stops = 0
+        self._budgets: Dict[Priority, int] = {}
+        self._revision = None
+
+    def reload(self, force=True):
+        if self._cache is None or force:
+            self._list = self.load_hook(Cache(self._path).get(default=[]))
+            self._cache = self._list
+            self._queues = {p: deque() for p in Priority}
+            self._keyed = {}
+            self._stops = 0
+            for op in self._list:
+                self._index(op)
+
+    def _index(self, op: Operation):
+        if op is None:
+            self._stops += 1
+            return
+        self._queues[op.priority].append(op)
+        key = op.key
+        if key is not None:
+            self._keyed.setdefault(key, deque()).append(op)
+
+    def _unindex(self, op: Operation):
+        if op is None:
+            self._stops -= 1
+            return
+        self._queues[op.priority].remove(op)
+        key = op.key
+        if key is not None:
+            ops = self._keyed[key]
+            ops.popleft()
+            if not ops:
+                del self._keyed[key]
+
+    def budgets(self):
+        """Concurrency budget of each priority class, read from config again only after it is reloaded."""
+        if not self._revision == config.revision:
+            self._budgets = {p: p.budget for p in Priority}
+            self._revision = config.revision
+        return self._budgets
+
     def save_hook(self, val):
         results = []
         for i in val:
@@ -60,7 +178,7 @@ class WorkerQueue(CacheQueue):
             ci.finished = None
             results.append(ci)
         return results
-    
+
     def load_hook(self, val):
         for i in val:
             if i.finished is None:
@@ -71,8 +189,124 @@ class WorkerQueue(CacheQueue):
                     setattr(ic, '_client', self._bot)
         return val
 
+    def unload(self):
+        if any(m.running for m in self._metrics.values()):
+            return False
+        return super().unload()
+
+    def _select(self):
+        if self._stops:
+            return None
+        budgets = self.budgets()
+        for p, ops in self._queues.items():
+            if (not ops) or self._metrics[p].running >= budgets[p]:
+                continue
+            for op in ops:
+                key = op.key
+                if key is None:
+                    return op
+                # Only the earliest queued operation of a key can run, and only when none of the key is running.
+                if self._keyed[key][0] is op and not self._active.get(key, 0):
+                    return op
+        return Def
+
+    async def get(self) -> Operation:
+        self.reload(force=False)
+        async with self._cond:
+            while True:
+                op = self._select()
+                if op is not Def:
+                    break
+                await self._cond.wait()
+            self._list.remove(op)
+            self._unindex(op)
+            Cache(self._path).set(val=self.save_hook(self._list))
+            if op is not None:
+                if op.key is not None:
+                    self._active[op.key] = self._active.get(op.key, 0) + 1
+                self._started[id(op)] = datetime.now()
+                self._metrics[op.priority].running += 1
+            return op
+
+    async def put(self, item: Operation):
+        self.reload(force=False)
+        async with self._cond:
+            self._list.append(item)
+            self._index(item)
+            Cache(self._path).set(val=self.save_hook(self._list))
+            self._cond.notify_all()
+
+    async def done(self, op: Operation):
+        """Release the concurrency slot of an operation returned by `get`."""
+        async with self._cond:
+            if op.key is not None:
+                self._active[op.key] -= 1
+                if not self._active[op.key]:
+                    del self._active[op.key]
+            started = self._started.pop(id(op))
+            metrics = self._metrics[op.priority]
+            metrics.running -= 1
+            metrics.processed += 1
+            metrics.requests += op.requests
+            metrics.errors += op.errors
+            metrics.wait += (started - op.created).total_seconds()
+            metrics.time += (datetime.now() - started).total_seconds()
+            self._cond.notify_all()
+
+    def metrics(self):
+        """Get current metrics of each priority class, including the number of queued operations."""
+        results = {}
+        for p, m in self._metrics.items():
+            queued = len(self._queues[p])
+            results[p] = {"queued": queued, **vars(m)}
+        return results
+
+
+class Lanes:
+    """
+    Keep sends of operations to the same recipient in order of reservation,
+    while sends to different recipients can proceed concurrently.
+    """
+
+    def __init__(self):
+        self._tails: Dict[int, asyncio.Future] = {}
+
+    def reserve(self, recipients: Iterable[int]):
+        """Reserve a turn for each recipient, which should be released by `turn` or `release`."""
+        loop = asyncio.get_running_loop()
+        tickets = {}
+        for r in recipients:
+            own = loop.create_future()
+            tickets[r] = (self._tails.get(r, None), own)
+            self._tails[r] = own
+        return tickets
+
+    @asynccontextmanager
+    async def turn(self, tickets: dict, recipient: int):
+        """Wait for previous reserved sends to the recipient to finish."""
+        prev, own = tickets.pop(recipient, (None, None))
+        try:
+            if prev:
+                await asyncio.wait([prev])
+            yield
+        finally:
+            if own:
+                self._release(recipient, own)
+
+    def release(self, tickets: dict):
+        for recipient, (_, own) in tickets.items():
+            self._release(recipient, own)
+        tickets.clear()
+
+    def _release(self, recipient: int, own: asyncio.Future):
+        if not own.done():
+            own.set_result(None)
+        if self._tails.get(recipient, None) is own:
+            del self._tails[recipient]
+
+
 class Worker:
-    async def report_status(self: "anonyabbot.GroupBot", time: int, requests: int, errors: int):
+    async def report_status(self: "anonyabbot.GroupBot", time: float, requests: int, errors: int):
         self.worker_status['time'] += time
         self.worker_status['requests'] += requests
         self.worker_status['errors'] += errors
@@ -82,20 +316,72 @@ class Worker:
             pool.worker_status['requests'] += requests
             pool.worker_status['errors'] += errors
             pool.worker_status.save()
-    
+
+    async def status_reporter(self: "anonyabbot.GroupBot"):
+        """Flush delivery statistics aggregated in memory into the cached worker status periodically."""
+        while True:
+            await asyncio.sleep(int(config.get("worker.report_interval", 30)))
+            spent, requests, errors = self.delivery.take_unreported()
+            if requests:
+                await self.report_status(spent, requests, errors)
+
+    def record_send(self: "anonyabbot.GroupBot", start: float, error: bool = False):
+        latency = time.perf_counter() - start
+        self.delivery.send(latency, error)
+        telemetry.deliveries.send(latency, error)
+
+    def expected_requests(self: "anonyabbot.GroupBot", op: Operation, n_members: int):
+        if isinstance(op, (BulkRedirectOperation, BulkPinOperation)):
+            return len(op.messages)
+        return n_members
+
+    def estimated_delay(self: "anonyabbot.GroupBot"):
+        """
+        Seconds for a new message to reach all members, from the measured per-recipient throughput and the sends queued
+        or running before it. None if nothing has been measured yet.
+        """
+        rate = self.delivery.throughput()
+        if not rate and self.worker_status["requests"]:
+            # Not measured since startup, assume full fan-out concurrency at the recorded mean send time.
+            mean = self.worker_status["time"] / self.worker_status["requests"]
+            rate = int(config.get("worker.fanout", 8)) / mean if mean else None
+        if not rate:
+            return None
+        n_members = self.group.n_members
+        ops = [op for op in (self.queue._list or []) if op is not None] + list(self.active_ops.values())
+        backlog = sum(max(0, self.expected_requests(op, n_members) - op.requests) for op in ops)
+        return (backlog + n_members) / rate
+
+    async def fetch_messages(self: "anonyabbot.GroupBot", messages: List[Message], weight: float = 1):
+        """Fetch source messages in batches grouped by source chat, returning a dict of (chat, mid) to message."""
+        chats: Dict[int, List[int]] = {}
+        for m in messages:
+            chats.setdefault(m.member.user.uid, []).append(m.mid)
+        results = {}
+        for uid, mids in chats.items():
+            for mids_batch in batch(mids, 200):
+                async with pool.scheduler.slot(self.name, weight):
+                    contexts = await self.bot.get_messages(uid, mids_batch)
+                for c in to_iterable(contexts):
+                    results[(uid, c.id)] = c
+        return results
+
     async def bulk_redirector(self: "anonyabbot.GroupBot", op: BulkRedirectOperation):
         try:
             if op.member.check_ban(BanType.RECEIVE, check_group=False, fail=False):
                 return
             if op.member.is_banned:
                 return
-            for message in op.messages:
-                await asyncio.sleep(1)
-                if message.member.id == op.member.id:
+            weight = self.send_weight()
+            messages = [m for m in op.messages if not m.member.id == op.member.id]
+            contexts = await self.fetch_messages(messages, weight)
+            for message in messages:
+                context = contexts.get((message.member.user.uid, message.mid), None)
+                if not context or context.empty:
+                    op.errors += 1
+                    op.requests += 1
                     continue
-                
-                context = await self.bot.get_messages(message.member.user.uid, message.mid)
-                
+
                 content = context.text or context.caption
                 if content:
                     content = f"{message.mask} | {content}"
@@ -107,28 +393,33 @@ class Worker:
                     rmr = message.reply_to.get_redirect_for(op.member)
 
                 try:
-                    if context.text:
-                        context.text = content
-                        masked_message = await context.copy(
-                            op.member.user.uid,
-                            reply_to_message_id=rmr.mid if rmr else None,
-                        )
-                    else:
-                        masked_message = await context.copy(
-                            op.member.user.uid,
-                            caption=content,
-                            reply_to_message_id=rmr.mid if rmr else None,
-                        )
+                    await pool.chat_limiter.wait((self.name, op.member.user.uid))
+                    async with pool.scheduler.slot(self.name, weight):
+                        start = time.perf_counter()
+                        if context.text:
+                            context.text = content
+                            masked_message = await context.copy(
+                                op.member.user.uid,
+                                reply_to_message_id=rmr.mid if rmr else None,
+                            )
+                        else:
+                            masked_message = await context.copy(
+                                op.member.user.uid,
+                                caption=content,
+                                reply_to_message_id=rmr.mid if rmr else None,
+                            )
+                    self.record_send(start, error=not masked_message)
                     if not masked_message:
                         op.errors += 1
                         continue
                 except RPCError as e:
+                    self.record_send(start, error=True)
                     if isinstance(e, (UserIsBlocked, UserDeactivated)) and not op.member.role == MemberRole.CREATOR:
-                        op.member.role = MemberRole.LEFT
-                        op.member.save()
+                        op.member.set_role(MemberRole.LEFT)
                     op.errors += 1
                 else:
-                    RedirectedMessage(mid=masked_message.id, message=message, to_member=op.member).save()
+                    message.add_redirect(op.member, masked_message.id)
+                    message.flush_redirects()
                 finally:
                     op.requests += 1
         except Exception as e:
@@ -142,22 +433,24 @@ class Worker:
                 return
             if op.member.is_banned:
                 return
+            weight = self.send_weight()
             for message in op.messages:
                 try:
                     if op.member.id == message.member.id:
-                        await self.bot.pin_chat_message(
-                            op.member.user.uid, message.mid, both_sides=True, disable_notification=True
-                        )
+                        mid = message.mid
                     else:
                         masked_message = message.get_redirect_for(op.member)
-                        if masked_message:
-                            await self.bot.pin_chat_message(
-                                op.member.user.uid, masked_message.mid, both_sides=True, disable_notification=True
-                            )
+                        mid = masked_message.mid if masked_message else None
+                    if mid:
+                        await pool.chat_limiter.wait((self.name, op.member.user.uid))
+                        async with pool.scheduler.slot(self.name, weight):
+                            start = time.perf_counter()
+                            await self.bot.pin_chat_message(op.member.user.uid, mid, both_sides=True, disable_notification=True)
+                            self.record_send(start)
                 except RPCError as e:
+                    self.record_send(start, error=True)
                     if isinstance(e, (UserIsBlocked, UserDeactivated)) and not op.member.role == MemberRole.CREATOR:
-                        op.member.role = MemberRole.LEFT
-                        op.member.save()
+                        op.member.set_role(MemberRole.LEFT)
                     op.errors += 1
                 finally:
                     op.requests += 1
@@ -166,146 +459,214 @@ class Worker:
         finally:
             op.finished.set()
     
-    async def worker(self: "anonyabbot.GroupBot"):
-        while True:
-            op = await self.queue.get()
-            if isinstance(op, BulkRedirectOperation):
-                asyncio.create_task(self.bulk_redirector(op))
+    def send_weight(self: "anonyabbot.GroupBot"):
+        """Weight of this group in the process-wide send scheduler."""
+        if self.group.is_prime:
+            return float(config.get("scheduler.prime_weight", 4))
+        else:
+            return 1.0
+
+    def recipients(self: "anonyabbot.GroupBot", op: Operation, include_sender=False):
+        results = []
+        m: Member
+        for m in self.group.user_members():
+            if (not include_sender) and m.id == op.member.id:
                 continue
-            if isinstance(op, BulkPinOperation):
-                asyncio.create_task(self.bulk_pinner(op))
+            if m.is_banned:
                 continue
-            try:
-                if not op:
-                    break
-                if isinstance(op, BroadcastOperation):
-                    if self.group.cannot(BanType.RECEIVE):
-                        op.finished.set()
-                        continue
+            if m.check_ban(BanType.RECEIVE, check_group=False, fail=False):
+                continue
+            results.append(m)
+        return results
 
-                    content = op.context.text or op.context.caption
+    async def fanout(
+        self: "anonyabbot.GroupBot",
+        members: List[Member],
+        func: Callable[[Member], Coroutine],
+        tickets: dict = None,
+    ):
+        """Run func for each member concurrently, with sends to each member ordered by the reserved tickets."""
+        semaphore = asyncio.Semaphore(int(config.get("worker.fanout", 8)))
+        weight = self.send_weight()
 
-                    if content:
-                        prefix = f"{op.message.mask} | "
-                        content = f"{prefix}{content}"
-                        offset = 0
-                        for c in prefix:
-                            offset += 1 if ord(c) < 65536 else 2
-                    else:
-                        content = f"{op.message.mask} has sent a media."
-                        offset = 0
-
-                    if op.context.text:   
-                        op.context.text = content
-                        if op.context.entities:
-                            e: MessageEntity
-                            for e in op.context.entities:
-                                e.offset += offset
+        async def run(m: Member):
+            async with self.lanes.turn(tickets or {}, m.id):
+                async with semaphore, pool.scheduler.slot(self.name, weight):
+                    start = time.perf_counter()
+                    try:
+                        await func(m)
+                    except RPCError as e:
+                        self.record_send(start, error=True)
+                        if isinstance(e, (UserIsBlocked, UserDeactivated)) and not m.role == MemberRole.CREATOR:
+                            m.set_role(MemberRole.LEFT)
+                        raise
                     else:
-                        op.context.caption = content
-                        if op.context.caption_entities:
-                            e: MessageEntity
-                            for e in op.context.caption_entities:
-                                e.offset += offset
-
-                    m: Member
-                    for m in self.group.user_members():
-                        if m.id == op.member.id:
-                            continue
-                        if m.is_banned:
-                            continue
-                        if m.check_ban(BanType.RECEIVE, check_group=False, fail=False):
-                            continue
-
-                        rmr = None
-                        if op.message.reply_to:
-                            rmr = op.message.reply_to.get_redirect_for(m)
-
-                        try:
-                            if op.context.text:
-                                masked_message = await op.context.copy(
-                                    m.user.uid,
-                                    reply_to_message_id=rmr.mid if rmr else None,
-                                )
-                            else:
-                                masked_message = await op.context.copy(
-                                    m.user.uid,
-                                    caption=content,
-                                    reply_to_message_id=rmr.mid if rmr else None,
-                                )
-                            if not masked_message:
-                                op.errors += 1
-                                continue
-                        except RPCError as e:
-                            if isinstance(e, (UserIsBlocked, UserDeactivated)) and not m.role == MemberRole.CREATOR:
-                                m.role = MemberRole.LEFT
-                                m.save()
-                            op.errors += 1
-                        else:
-                            RedirectedMessage(mid=masked_message.id, message=op.message, to_member=m).save()
-                        finally:
-                            op.requests += 1
+                        self.record_send(start)
 
-                elif isinstance(op, EditOperation):
-                    if self.group.cannot(BanType.RECEIVE):
-                        op.finished.set()
-                        continue
+        results = await asyncio.gather(*[run(m) for m in members], return_exceptions=True)
+        for r in results:
+            if isinstance(r, Exception) and not isinstance(r, RPCError):
+                self.log.opt(exception=r).warning("Worker error:")
+        return results
 
-                    content = op.context.text or op.context.caption
+    async def broadcaster(self: "anonyabbot.GroupBot", op: BroadcastOperation, recipients: List[Member], tickets: dict):
+        if self.group.cannot(BanType.RECEIVE):
+            return
 
-                    if content:
-                        content = f"{op.message.mask} | {content}"
-                    else:
-                        content = f"{op.message.mask} has sent a media."
-
-                    m: Member
-                    for m in self.group.user_members():
-                        if m.id == op.member.id:
-                            continue
-                        if m.is_banned:
-                            continue
-                        if m.check_ban(BanType.RECEIVE, check_group=False, fail=False):
-                            continue
-
-                        try:
-                            masked_message = op.message.get_redirect_for(m)
-                            if masked_message:
-                                await self.bot.edit_message_text(masked_message.to_member.user.uid, masked_message.mid, content)
-                        except RPCError as e:
-                            if isinstance(e, (UserIsBlocked, UserDeactivated)) and not m.role == MemberRole.CREATOR:
-                                m.role = MemberRole.LEFT
-                                m.save()
-                            op.errors += 1
-                        finally:
-                            op.requests += 1
-
-                elif isinstance(op, DeleteOperation):
-                    if self.group.cannot(BanType.RECEIVE):
-                        op.finished.set()
-                        continue
+        content = op.context.text or op.context.caption
+
+        if content:
+            prefix = f"{op.message.mask} | "
+            content = f"{prefix}{content}"
+            offset = 0
+            for c in prefix:
+                offset += 1 if ord(c) < 65536 else 2
+        else:
+            content = f"{op.message.mask} has sent a media."
+            offset = 0
 
-                    m: Member
-                    for m in self.group.user_members():
-                        if m.is_banned:
-                            continue
-                        if m.check_ban(BanType.RECEIVE, check_group=False, fail=False):
-                            continue
-
-                        try:
-                            if m.id == op.message.member.id:
-                                await self.bot.delete_messages(op.message.member.user.uid, op.message.mid)
-                            else:
-                                masked_message = op.message.get_redirect_for(m)
-                                if masked_message:
-                                    await self.bot.delete_messages(masked_message.to_member.user.uid, masked_message.mid)
-                        except RPCError as e:
-                            if isinstance(e, (UserIsBlocked, UserDeactivated)) and not m.role == MemberRole.CREATOR:
-                                m.role = MemberRole.LEFT
-                                m.save()
-                            op.errors += 1
-                        finally:
-                            op.requests += 1
-            except Exception as e:
-                self.log.opt(exception=e).warning("Worker error:")
+        if op.context.text:
+            op.context.text = content
+            if op.context.entities:
+                e: MessageEntity
+                for e in op.context.entities:
+                    e.offset += offset
+        else:
+            op.context.caption = content
+            if op.context.caption_entities:
+                e: MessageEntity
+                for e in op.context.caption_entities:
+                    e.offset += offset
+
+        async def send(m: Member):
+            rmr = None
+            if op.message.reply_to:
+                rmr = op.message.reply_to.get_redirect_for(m)
+
+            try:
+                if op.context.text:
+                    masked_message = await op.context.copy(
+                        m.user.uid,
+                        reply_to_message_id=rmr.mid if rmr else None,
+                    )
+                else:
+                    masked_message = await op.context.copy(
+                        m.user.uid,
+                        caption=content,
+                        reply_to_message_id=rmr.mid if rmr else None,
+                    )
+                if not masked_message:
+                    op.errors += 1
+                    return
+            except RPCError:
+                op.errors += 1
+                raise
+            else:
+                op.message.add_redirect(m, masked_message.id)
+            finally:
+                op.requests += 1
+
+        async def flusher():
+            # Redirects are buffered in memory, so write them as the fanout goes to keep losses small on a crash.
+            while True:
+                await asyncio.sleep(float(config.get("worker.redirect_flush", 0.05)))
+                await committer.run(op.message.flush_redirects)
+
+        flush_task = asyncio.create_task(flusher())
+        try:
+            await self.fanout(recipients, send, tickets)
+        finally:
+            flush_task.cancel()
+            op.message.flush_redirects()
+
+    async def editor(self: "anonyabbot.GroupBot", op: EditOperation):
+        if self.group.cannot(BanType.RECEIVE):
+            return
+
+        content = op.context.text or op.context.caption
+
+        if content:
+            content = f"{op.message.mask} | {content}"
+        else:
+            content = f"{op.message.mask} has sent a media."
+
+        async def edit(m: Member):
+            try:
+                masked_message = op.message.get_redirect_for(m)
+                if masked_message:
+                    await self.bot.edit_message_text(masked_message.to_member.user.uid, masked_message.mid, content)
+            except RPCError:
+                op.errors += 1
+                raise
+            finally:
+                op.requests += 1
+
+        await self.fanout(self.recipients(op), edit)
+
+    async def deleter(self: "anonyabbot.GroupBot", op: DeleteOperation):
+        if self.group.cannot(BanType.RECEIVE):
+            return
+
+        async def delete(m: Member):
+            try:
+                if m.id == op.message.member.id:
+                    await self.bot.delete_messages(op.message.member.user.uid, op.message.mid)
+                else:
+                    masked_message = op.message.get_redirect_for(m)
+                    if masked_message:
+                        await self.bot.delete_messages(masked_message.to_member.user.uid, masked_message.mid)
+            except RPCError:
+                op.errors += 1
+                raise
             finally:
-                op.finished.set()
\ No newline at end of file
+                op.requests += 1
+
+        await self.fanout(self.recipients(op, include_sender=True), delete)
+
+    async def process(self: "anonyabbot.GroupBot", op: Operation, recipients: List[Member] = None, tickets: dict = None):
+        self.active_ops[id(op)] = op
+        self.delivery.begin()
+        telemetry.deliveries.begin()
+        try:
+            if isinstance(op, BulkRedirectOperation):
+                await self.bulk_redirector(op)
+            elif isinstance(op, BulkPinOperation):
+                await self.bulk_pinner(op)
+            elif isinstance(op, BroadcastOperation):
+                await self.broadcaster(op, recipients, tickets)
+            elif isinstance(op, EditOperation):
+                await self.editor(op)
+            elif isinstance(op, DeleteOperation):
+                await self.deleter(op)
+        except Exception as e:
+            self.log.opt(exception=e).warning("Worker error:")
+        finally:
+            if tickets:
+                self.lanes.release(tickets)
+            latency = (datetime.now() - op.created).total_seconds()
+            self.delivery.end(latency)
+            telemetry.deliveries.end(latency)
+            del self.active_ops[id(op)]
+            op.finished.set()
+            await self.queue.done(op)
+
+    async def worker(self: "anonyabbot.GroupBot"):
+        tasks = set()
+        try:
+            while True:
+                op = await self.queue.get()
+                if not op:
+                    break
+                partitions.bind(self.group.id)
+                if isinstance(op, BroadcastOperation):
+                    # Turns are reserved in dequeue order, so that broadcasts reach each member in order.
+                    recipients = self.recipients(op)
+                    tickets = self.lanes.reserve(m.id for m in recipients)
+                else:
+                    recipients = tickets = None
+                t = asyncio.create_task(self.process(op, recipients, tickets))
+                tasks.add(t)
+                t.add_done_callback(tasks.discard)
+        finally:
+            for t in tasks:
+                t.cancel()
@@ -1,10 +1,11 @@
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from loguru import logger
 
-from ..utils import AsyncTaskPool
+from ..utils import AsyncTaskPool, FairScheduler, RateLimiter
 from ..cache import CacheDict
+from ..config import config
 from ..model import Group, User
 from .group import GroupBot
 
@@ -28,6 +29,14 @@ worker_status = CacheDict(
 )
 worker_status_lock = asyncio.Lock()
 
+scheduler = FairScheduler(lambda: int(config.get("scheduler.slots", 32)))
+
+# Telegram allows a bot about one message per second in a private chat, with short bursts.
+chat_limiter = RateLimiter(
+    lambda: float(config.get("scheduler.chat_rate", 1)),
+    lambda: int(config.get("scheduler.chat_burst", 3)),
+)
+
 async def queue_monitor():
     while True:
         token, creator, event = await start_queue.get()
@@ -74,7 +83,24 @@ async def start_groups():
     logger.info("All groupbots are started.")
 
 
+async def hibernation_monitor():
+    while True:
+        await asyncio.sleep(config.get("hibernation.interval", 3600))
+        idle_days = config.get("hibernation.idle_days", 30)
+        if not idle_days:
+            continue
+        date_ago = datetime.now() - timedelta(days=idle_days)
+        gb: GroupBot
+        for gb in list(token_cls.values()):
+            if gb.group and (not gb.hibernated) and gb.group.last_activity < date_ago:
+                try:
+                    await gb.hibernate()
+                except Exception as e:
+                    logger.opt(exception=e).warning("Hibernation error:")
+
+
 async def start():
     pool.add(queue_monitor())
     pool.add(start_groups())
+    pool.add(hibernation_monitor())
     await pool.wait()
@@ -106,6 +106,10 @@ class CacheDict(ProxyBase):
     def save(self, ttl=None):
         self.reload(force=False)
         Cache(self._path).set(val=self._cache, ttl=ttl)
+
+    def unload(self):
+        """Drop the in-memory copy, which will be reloaded from cache on next access."""
+        self._cache = None
         
 class CacheQueue(ProxyBase):
     __noproxy__ = ("_cache", "_list", "_path")
@@ -131,6 +135,14 @@ class CacheQueue(ProxyBase):
                 
     def load_hook(self, val):
         return val
+
+    def unload(self):
+        """Drop the in-memory queue if it is empty, which will be reloaded from cache on next access."""
+        if self._list:
+            return False
+        self._cache = None
+        self._list = None
+        return True
         
     async def get(self):
         self.reload(force=False)
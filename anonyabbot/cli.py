@@ -6,6 +6,7 @@ import uvloop
 import typer
 from appdirs import user_data_dir
 from loguru import logger
+from peewee import SqliteDatabase
 from rich.logging import Console, RichHandler
 from rich.theme import Theme
 
@@ -13,14 +14,19 @@ uvloop.install()
 
 from . import __product__, __author__, __url__, __version__
 from .config import config
-from .bot.fix import patch_pyrogram
+from .bot.fix import patch_pyrogram, patch_invoke
+from .telemetry import patch_clients, lag_monitor
 
 patch_pyrogram()
+patch_invoke()
+patch_clients()
 
 from .bot.pool import start as start_pool
+from .maintenance import start as start_maintenance
+from .metrics import start as start_metrics
 from .bot.father import FatherBot
 from .bot.pm import PMBot
-from .model import BaseModel, db
+from .model import BaseModel, db, partitions, init_database, migrate_tables, sqlite_pragmas
 
 
 def formatter(record):
@@ -67,10 +73,29 @@ def main(
     basedir = Path(config.get("basedir", user_data_dir(__product__)))
     logger.debug(f'Now using basedir at "{basedir.absolute()}"')
     basedir.mkdir(parents=True, exist_ok=True)
-    db.init(str(basedir / f"{__product__}.db"), pragmas={"journal_mode": "wal"})
+    pragmas = sqlite_pragmas()
+    database = init_database(basedir / f"{__product__}.db", pragmas=pragmas)
+    logger.debug(f"Now using {type(database).__name__} as database.")
+    if config.get("database.partition", False):
+        if not isinstance(database, SqliteDatabase):
+            raise ValueError("database partitioning is only supported with SQLite")
+        partitions.init(basedir / "partitions", pragmas=pragmas)
+        logger.debug(f'Now storing messages of each group at "{(basedir / "partitions").absolute()}"')
     db.create_tables(BaseModel.__subclasses__())
+    if migrate_tables():
+        logger.info("Database tables are migrated to the latest schema.")
+    moved = partitions.import_all()
+    if moved:
+        logger.info(f"{moved} rows are moved from the central database into group partitions.")
 
     async def async_main():
-        await asyncio.gather(FatherBot(config["father.token"]).start(), PMBot(config["pm.token"]).start(), start_pool())
+        await asyncio.gather(
+            FatherBot(config["father.token"]).start(),
+            PMBot(config["pm.token"]).start(),
+            start_pool(),
+            start_maintenance(),
+            start_metrics(),
+            lag_monitor(),
+        )
 
     asyncio.run(async_main())
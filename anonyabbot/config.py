@@ -27,12 +27,18 @@ class ConfigChangeHandler(FileSystemEventHandler):
         self.func()
 
 class Config(ProxyBase):
-    __noproxy__ = ("_conf_file", "_cache", "_observer", "__getitem__")
+    __noproxy__ = ("_conf_file", "_cache", "_observer", "_revision", "__getitem__")
 
     def __init__(self, conf_file=None):
         self._conf_file = conf_file
         self._cache = None
         self._observer = None
+        self._revision = 0
+
+    @property
+    def revision(self):
+        """A number which changes on every reload, for invalidating values derived from config."""
+        return self._revision
 
     @property
     def __subject__(self):
@@ -74,6 +80,7 @@ class Config(ProxyBase):
         logger.debug(f'Now using config file at "{conf_file.absolute()}".')
         self._conf_file = conf_file
         self._cache = box
+        self._revision += 1
         self.start_observer(conf_file, box)
 
     def __getitem__(self, key):
@@ -0,0 +1,155 @@
+import asyncio
+from datetime import datetime
+from pathlib import Path
+import sqlite3
+import time
+from typing import Dict
+
+from loguru import logger
+from peewee import SqliteDatabase
+
+from .config import config
+from .model import db, partitions, committer, Group, Statistic
+
+
+async def compactor():
+    """Delete expired redirected messages in small chunks, and reclaim free pages incrementally."""
+    warned = False
+    while True:
+        await asyncio.sleep(config.get("retention.interval", 3600))
+        chunk = int(config.get("retention.chunk", 1000))
+        total = 0
+        g: Group
+        for g in Group.select().where(~(Group.disabled)).iterator():
+            try:
+                while True:
+                    n = g.compact(chunk)
+                    total += n
+                    await asyncio.sleep(0.1)
+                    if n < chunk:
+                        break
+            except Exception as e:
+                logger.opt(exception=e).warning(f"Compaction error for group @{g.username}:")
+        if total:
+            logger.info(f"Compaction finished, {total} expired redirected messages are deleted.")
+        if not isinstance(db.obj, SqliteDatabase):
+            continue
+        for database in partitions.each():
+            if database.execute_sql("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                database.execute_sql(f"PRAGMA incremental_vacuum({int(config.get('retention.vacuum_pages', 1000))})").fetchall()
+            elif not warned:
+                logger.warning("Database is not in incremental auto vacuum mode, run VACUUM once offline to enable it.")
+                warned = True
+            await asyncio.sleep(0.1)
+
+
+wal_status: Dict[str, dict] = {}
+
+
+def checkpoint(path: Path, mode: str):
+    """Checkpoint the WAL of a SQLite file with a separate connection, returns (busy, wal frames, checkpointed frames)."""
+    con = sqlite3.connect(str(path), timeout=int(config.get("database.checkpoint.timeout", 5)))
+    try:
+        return con.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    finally:
+        con.close()
+
+
+def set_autocheckpoint(running: bool):
+    """
+    Raise the automatic checkpoint threshold while the checkpointer runs, so that commits rarely checkpoint themselves,
+    and restore the SQLite default otherwise. The threshold is never disabled, to bound the WAL if checkpoints stop.
+    """
+    if "wal_autocheckpoint" in config.get("database.sqlite", {}):
+        return
+    pages = int(config.get("database.checkpoint.fallback_pages", 16384)) if running else 1000
+    if partitions.pragmas.get("wal_autocheckpoint", None) != pages:
+        partitions.set_pragma("wal_autocheckpoint", pages)
+
+
+async def checkpointer():
+    """Run passive WAL checkpoints in a thread, and truncate the WAL once it grows too large."""
+    if not isinstance(db.obj, SqliteDatabase):
+        return
+    try:
+        while True:
+            interval = config.get("database.checkpoint.interval", 30)
+            set_autocheckpoint(bool(interval))
+            await asyncio.sleep(interval or 60)
+            if interval:
+                await checkpoint_all()
+    finally:
+        set_autocheckpoint(False)
+
+
+async def checkpoint_all():
+    """Checkpoint the central database and all partitions in turn, truncating WALs which grew too large."""
+    truncate_size = int(config.get("database.checkpoint.truncate_size", 64 * 1024 * 1024))
+    for path in partitions.files():
+        wal = path.with_name(path.name + "-wal")
+        try:
+            size = wal.stat().st_size if wal.exists() else 0
+            mode = "TRUNCATE" if size > truncate_size else "PASSIVE"
+            start = time.perf_counter()
+            busy, frames, checkpointed = await asyncio.to_thread(checkpoint, path, mode)
+            spent = time.perf_counter() - start
+        except Exception as e:
+            logger.opt(exception=e).warning(f'Checkpoint error for "{path.name}":')
+            continue
+        wal_status[path.name] = {
+            "size": wal.stat().st_size if wal.exists() else 0,
+            "mode": mode,
+            "busy": bool(busy),
+            "frames": frames,
+            "checkpointed": checkpointed,
+            "time": spent,
+        }
+        if mode == "TRUNCATE":
+            logger.debug(f'WAL of "{path.name}" truncated from {size} bytes in {spent:.2f}s.')
+
+
+def in_thread(func, *args):
+    """Run a database function on connections of the calling worker thread, which are closed afterwards."""
+    try:
+        return func(*args)
+    finally:
+        for database in [db.obj, *list(partitions.databases.values())]:
+            if not database.is_closed():
+                database.close()
+
+
+async def statistician():
+    """
+    Recount system statistics and group counters from scratch in a worker thread, correcting drift of the counters
+    maintained by write paths. All groups are recounted at startup, and later only groups active since the last pass.
+    """
+    since = None
+    while True:
+        started = datetime.now()
+        try:
+            committer.flush()
+            start = time.perf_counter()
+            await asyncio.to_thread(in_thread, Statistic.recount)
+            logger.debug(f"System statistics recounted in {time.perf_counter() - start:.2f}s.")
+        except Exception as e:
+            logger.opt(exception=e).warning("Statistics recount error:")
+        fixed = 0
+        groups = Group.select()
+        if since:
+            groups = groups.where(Group.last_activity >= since)
+        g: Group
+        for g in list(groups):
+            try:
+                committer.flush()
+                fixed += await asyncio.to_thread(in_thread, g.recount)
+            except Exception as e:
+                logger.opt(exception=e).warning(f"Counter recount error for group @{g.username}:")
+            await asyncio.sleep(0.1)
+        if fixed:
+            logger.info(f"Counter recount finished, {fixed} drifted groups or members are fixed.")
+        since = started
+        await asyncio.sleep(config.get("statistics.interval", 3600))
+
+
+async def start():
+    await asyncio.gather(compactor(), checkpointer(), statistician())
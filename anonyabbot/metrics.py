@@ -0,0 +1,133 @@
+"""
+Optional HTTP endpoint exposing internals in Prometheus text format, enabled by "metrics.port".
+Metrics are read from in-memory state only, so scraping never queries the database.
+"""
+
+import asyncio
+from pathlib import Path
+import resource
+from typing import Dict, List
+
+from loguru import logger
+
+from . import __product__, telemetry
+from .config import config
+from .telemetry import BUCKETS, Histogram
+
+
+def labels(**kw):
+    if not kw:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in kw.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(kw, escaped)) + "}"
+
+
+class Exposition:
+    """Builder of a Prometheus text format page, with samples grouped by metric family."""
+
+    def __init__(self):
+        self.families: Dict[str, List[str]] = {}
+
+    def family(self, name: str, kind: str, help: str):
+        if name not in self.families:
+            self.families[name] = [f"# HELP {__product__}_{name} {help}", f"# TYPE {__product__}_{name} {kind}"]
+        return self.families[name]
+
+    def sample(self, name: str, kind: str, help: str, value: float, **kw):
+        self.family(name, kind, help).append(f"{__product__}_{name}{labels(**kw)} {value}")
+
+    def histogram(self, name: str, help: str, h: Histogram, **kw):
+        lines = self.family(name, "histogram", help)
+        cumulative = 0
+        for bound, c in zip(BUCKETS, h.counts):
+            cumulative += c
+            le = "+Inf" if bound == float("inf") else str(bound)
+            lines.append(f"{__product__}_{name}_bucket{labels(**kw, le=le)} {cumulative}")
+        lines.append(f"{__product__}_{name}_sum{labels(**kw)} {h.sum}")
+        lines.append(f"{__product__}_{name}_count{labels(**kw)} {h.count}")
+
+    def render(self):
+        return "\n".join(l for lines in self.families.values() for l in lines) + "\n"
+
+
+def memory_usage():
+    """Resident set size in bytes, or peak resident size where /proc is not available."""
+    statm = Path("/proc/self/statm")
+    if statm.exists():
+        return int(statm.read_text().split()[1]) * resource.getpagesize()
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def collect():
+    from .bot import pool
+
+    e = Exposition()
+    bots: Dict[str, int] = {"running": 0, "hibernated": 0}
+    for gb in list(pool.token_cls.values()):
+        bots["hibernated" if gb.hibernated else "running"] += 1
+        group = gb.name
+        e.sample("group_queue_depth", "gauge", "Operations waiting in the worker queue.", len(gb.queue._list or []), group=group)
+        e.sample("group_active_operations", "gauge", "Operations being processed.", len(gb.active_ops), group=group)
+        e.sample("group_sends_total", "counter", "Messages sent to members.", gb.delivery.sends, group=group)
+        e.sample("group_send_errors_total", "counter", "Failed sends to members.", gb.delivery.errors, group=group)
+    for state, n in bots.items():
+        e.sample("group_bots", "gauge", "Group bots by state.", n, state=state)
+    e.sample("send_slots_running", "gauge", "Process-wide send slots in use.", pool.scheduler.running)
+    e.sample("send_slots_waiting", "gauge", "Sends waiting for a slot.", pool.scheduler.waiting)
+    e.sample("sends_total", "counter", "Messages sent to members by all groups.", telemetry.deliveries.sends)
+    e.sample("send_errors_total", "counter", "Failed sends by all groups.", telemetry.deliveries.errors)
+    for method, h in list(telemetry.api.methods.items()):
+        e.histogram("api_call_latency_seconds", "Latency of Telegram API calls.", h, method=method)
+    for bot, n in list(telemetry.api.bots.items()):
+        e.sample("api_calls_total", "counter", "Telegram API calls by bot.", n, bot=bot)
+    for (method, error), n in list(telemetry.api.errors.items()):
+        e.sample("api_errors_total", "counter", "Telegram API calls failed with an error.", n, method=method, error=error)
+    for method, seconds in list(telemetry.api.flood_waits.items()):
+        e.sample("flood_wait_seconds_total", "counter", "FloodWait seconds required by Telegram.", seconds, method=method)
+    e.histogram("flood_wait_seconds", "FloodWait durations required by Telegram.", telemetry.api.flood_wait)
+    e.histogram("send_latency_seconds", "Latency of a send to one member.", telemetry.deliveries.send_latency)
+    e.histogram("operation_latency_seconds", "Latency of worker operations from submission.", telemetry.deliveries.op_latency)
+    e.histogram("db_query_latency_seconds", "Latency of database statements.", telemetry.db_latency)
+    e.histogram("cache_latency_seconds", "Latency of cache commands.", telemetry.cache_latency)
+    e.histogram("event_loop_lag_seconds", "Delay of event loop callbacks beyond schedule.", telemetry.loop_lag)
+    for name, stats in list(telemetry.handlers.items()):
+        e.histogram("handler_latency_seconds", "Latency of update handlers.", stats.latency, handler=name)
+    e.sample("memory_rss_bytes", "gauge", "Resident memory of the process.", memory_usage())
+    return e.render()
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await asyncio.wait_for(reader.readline(), 10)
+        while (await asyncio.wait_for(reader.readline(), 10)).strip():
+            pass
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+            status, body = "200 OK", collect().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    except Exception as e:
+        logger.opt(exception=e).warning("Metrics endpoint error:")
+    finally:
+        writer.close()
+
+
+async def start():
+    port = config.get("metrics.port", None)
+    if not port:
+        return
+    host = config.get("metrics.host", "127.0.0.1")
+    server = await asyncio.start_server(handle, host, int(port))
+    logger.info(f"Metrics are served at http://{host}:{port}/metrics.")
+    async with server:
+        await server.serve_forever()
@@ -1,16 +1,269 @@
 from __future__ import annotations
 
+import asyncio
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar, copy_context
 from datetime import datetime, timedelta
+from functools import partial
+from pathlib import Path
 import random
 import string
-from typing import Iterable, List, Type, Union
+import struct
+from typing import Dict, Iterable, List, Type, Union
 
 from aenum import IntEnum
+from loguru import logger
 from peewee import *
+from playhouse.migrate import SchemaMigrator, migrate
+from playhouse.pool import PooledPostgresqlDatabase
+
+from .config import config
+from .utils import Def, LRUCache, to_iterable, extract
+
+db = DatabaseProxy()
+
+SQLITE_PROFILE = {
+    "synchronous": "normal",
+    "cache_size": -65536,
+    "mmap_size": 268435456,
+    "busy_timeout": 5000,
+    "temp_store": "memory",
+}
+
+# Every open partition holds its own connection and page cache, so they get a much smaller share.
+PARTITION_PROFILE = {
+    "cache_size": -8192,
+    "mmap_size": 33554432,
+}
+
+
+def sqlite_pragmas():
+    """SQLite pragmas of the tuning profile, overridable by the "database.sqlite" config section."""
+    pragmas = {"auto_vacuum": "incremental", "journal_mode": "wal"}
+    pragmas.update(SQLITE_PROFILE)
+    pragmas.update(config.get("database.sqlite", {}))
+    return pragmas
+
+
+def init_database(path: Union[str, Path], pragmas: dict = None):
+    """Initialize the database according to the "database" config section, SQLite at path is used by default."""
+    conf = config.get("database", {})
+    kind = conf.get("type", "sqlite")
+    if kind == "sqlite":
+        database = SqliteDatabase(str(path), pragmas=pragmas)
+    elif kind in ("postgres", "postgresql"):
+        database = PooledPostgresqlDatabase(
+            conf.get("name", "anonyabbot"),
+            host=conf.get("host", "localhost"),
+            port=int(conf.get("port", 5432)),
+            user=conf.get("user", None),
+            password=conf.get("password", None),
+            max_connections=int(conf.get("max_connections", 8)),
+            stale_timeout=int(conf.get("stale_timeout", 300)),
+            timeout=int(conf.get("timeout", 10)),
+        )
+        for model in BaseModel.__subclasses__():
+            model._meta.without_rowid = False
+    else:
+        raise ValueError(f'database type "{kind}" is not supported')
+    db.initialize(database)
+    return database
+
+
+def cache_size(key: str, default: int = 10000):
+    """
+    Size of a process-local cache of database rows, read from the config key.
+
+    With PostgreSQL, several bot processes may share the database, and a change written by one of them never
+    invalidates the caches of the others. So caches of data that other processes can change (user roles and ban
+    groups) are disabled by default there. Pending redirections are not affected: they only buffer writes of
+    broadcasts which this process is sending, and updates of a group are always handled by the one process that
+    runs its bot.
+    """
+    if config.get("database.type", "sqlite") in ("postgres", "postgresql"):
+        default = 0
+    return int(config.get(key, default))
+
+
+class PartitionRouter(DatabaseProxy):
+    """
+    Database of high-volume message tables, which routes queries to per-group database files if partitioning is enabled.
+    The group is taken from the current context, and queries outside any group context use the central database.
+    """
+
+    __slots__ = ("central", "current", "directory", "pragmas", "models", "databases")
+    __setattr__ = object.__setattr__
+
+    def __init__(self, central: Database):
+        self.central = central
+        self.current: ContextVar[int] = ContextVar("partition", default=None)
+        self.directory: Path = None
+        self.pragmas = {}
+        self.models: List[Type[Model]] = []
+        self.databases: OrderedDict[int, Database] = OrderedDict()
 
-from .utils import to_iterable, extract
+    @property
+    def obj(self):
+        database = self.database()
+        return database.obj if isinstance(database, Proxy) else database
 
-db = SqliteDatabase(None)
+    def attach_callback(self, callback):
+        return self.central.attach_callback(callback)
+
+    def init(self, directory: Union[str, Path], pragmas: dict = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.pragmas = dict(pragmas or {})
+        self.pragmas.update(PARTITION_PROFILE)
+        self.pragmas.update(config.get("database.sqlite_partition", {}))
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def database(self, group_id: int = Def):
+        if group_id is Def:
+            group_id = self.current.get()
+        if (not self.enabled) or group_id is None:
+            return self.central
+        database = self.databases.get(group_id, None)
+        if not database:
+            database = self.open(group_id)
+        else:
+            self.databases.move_to_end(group_id)
+            if database.is_closed():
+                self.evict()
+        return database
+
+    def open(self, group_id: int):
+        path = self.directory / f"group_{group_id}.db"
+        self.evict()
+        database = self.databases[group_id] = SqliteDatabase(str(path), pragmas=self.pragmas)
+        with self.using(group_id):
+            database.create_tables(self.models)
+            migrate_tables(database, self.models)
+        return database
+
+    def close(self, group_id: int):
+        database = self.databases.get(group_id, None)
+        if database:
+            database.close()
+
+    def evict(self):
+        """
+        Close least recently used partition connections before another one is opened,
+        so that at most "database.partition_max_open" page caches are held at once.
+        """
+        opened = [d for d in self.databases.values() if not d.is_closed()]
+        excess = len(opened) - int(config.get("database.partition_max_open", 32)) + 1
+        for database in opened:
+            if excess <= 0:
+                break
+            if not database.in_transaction():
+                database.close()
+                excess -= 1
+
+    def set_pragma(self, key: str, value):
+        """Change a pragma of the central database and all partitions, including connections opened later."""
+        self.pragmas[key] = value
+        for database in [self.central.obj, *self.databases.values()]:
+            if not isinstance(database, SqliteDatabase):
+                continue
+            if database.is_closed():
+                database._pragmas = list({**dict(database._pragmas), key: value}.items())
+            else:
+                database.pragma(key, value, permanent=True)
+
+    def bind(self, group_id: int):
+        """Route queries in the current context (and tasks created from it) to the group."""
+        self.current.set(group_id)
+
+    @contextmanager
+    def using(self, group_id: int):
+        token = self.current.set(group_id)
+        try:
+            yield
+        finally:
+            self.current.reset(token)
+
+    def each(self):
+        """Iterate the central database and all partitions, routing queries to each of them in turn."""
+        with self.using(None):
+            yield self.central
+        if self.enabled:
+            for path in sorted(self.directory.glob("group_*.db")):
+                group_id = int(path.stem[len("group_") :])
+                with self.using(group_id):
+                    yield self.database(group_id)
+
+    def files(self):
+        """Paths of the central SQLite database and all partitions, without opening them."""
+        files = []
+        if isinstance(self.central.obj, SqliteDatabase) and not self.central.database == ":memory:":
+            files.append(Path(self.central.database))
+        if self.enabled:
+            files.extend(sorted(self.directory.glob("group_*.db")))
+        return files
+
+    def pending_imports(self):
+        """Ids of groups which still have message rows in the central database."""
+        with self.using(None):
+            messages = Message.select(Message.group).distinct()
+            pms = Member.select(Member.group).join(PMMessage, on=(PMMessage.to_member == Member.id)).distinct()
+            return sorted({m.group_id for m in messages} | {m.group_id for m in pms})
+
+    def import_all(self):
+        """
+        Move rows left in the central database into the partition of each group, to be run offline before serving.
+        Returns the number of rows moved.
+        """
+        if not self.enabled:
+            return 0
+        return sum(self.import_group(group_id) for group_id in self.pending_imports())
+
+    def import_group(self, group_id: int, chunk: int = 500):
+        """
+        Move existing rows of the group from the central database into its partition.
+        Each chunk is committed on its own, and rows are copied before any is deleted, so that an interrupted import
+        can be run again.
+        """
+        members = Member.select(Member.id).where(Member.group == group_id)
+        messages = Message.select(Message.id).where(Message.group == group_id)
+        tables = [
+            (Message, Message.id << messages),
+            (RedirectedMessage, RedirectedMessage.message << messages),
+            (RedirectMap, RedirectMap.message << messages),
+            (RedirectIndex, RedirectIndex.message << messages),
+            (PMMessage, PMMessage.to_member << members),
+        ]
+        moved = 0
+        for model, where in tables:
+            fields = model._meta.sorted_fields
+            keys = model._meta.get_primary_keys()
+            positions = [fields.index(k) for k in keys]
+            last = None
+            while True:
+                with self.using(None):
+                    query = model.select(*fields).where(where).order_by(*keys).limit(chunk)
+                    if last is not None:
+                        query = query.where(Tuple(*keys) > Tuple(*last))
+                    rows = list(query.tuples())
+                if not rows:
+                    break
+                with self.using(group_id):
+                    with self.atomic():
+                        model.insert_many(rows, fields=fields).on_conflict_ignore().execute()
+                last = [rows[-1][i] for i in positions]
+                moved += len(rows)
+        with self.using(None):
+            for model, where in reversed(tables):
+                keys = model._meta.get_primary_keys()
+                while True:
+                    with self.atomic():
+                        if not model.delete().where(Tuple(*keys) << model.select(*keys).where(where).limit(chunk)).execute():
+                            break
+        return moved
 
 
 class OperationError(Exception):
@@ -74,18 +327,30 @@ class MemberRole(IntEnum):
 
 
 class BanType(IntEnum):
-    _init_ = "value display"
+    # Bits are stored in BanGroup.mask, so they must never change once assigned.
+    _init_ = "value display bit"
+
+    NONE = 0, "unknown", 1 << 0
+    RECEIVE = 10, "receive messages from others", 1 << 1
+    MESSAGE = 20, "send messages", 1 << 2
+    MEDIA = 21, "send messages with medias", 1 << 3
+    STICKER = 22, "send stickers", 1 << 4
+    MARKUP = 23, "send messages with reply markups", 1 << 5
+    LONG = 24, "send messages longer than 200 characters", 1 << 6
+    LINK = 25, "send messages including links or mentions", 1 << 7
+    PM_USER = 50, "pm other user in the group", 1 << 8
+    PM_ADMIN = 51, "pm admins in the group", 1 << 9
+
+    @classmethod
+    def to_mask(cls, types: Iterable[BanType]):
+        mask = 0
+        for t in to_iterable(types):
+            mask |= t.bit
+        return mask
 
-    NONE = 0, "unknown"
-    RECEIVE = 10, "receive messages from others"
-    MESSAGE = 20, "send messages"
-    MEDIA = 21, "send messages with medias"
-    STICKER = 22, "send stickers"
-    MARKUP = 23, "send messages with reply markups"
-    LONG = 24, "send messages longer than 200 characters"
-    LINK = 25, "send messages including links or mentions"
-    PM_USER = 50, "pm other user in the group"
-    PM_ADMIN = 51, "pm admins in the group"
+    @classmethod
+    def from_mask(cls, mask: int):
+        return [t for t in cls if t.bit & mask]
 
 
 class EnumField(IntegerField):
@@ -105,14 +370,111 @@ class BaseModel(Model):
         database = db
 
 
+partitions = PartitionRouter(db)
+
+
+class GroupCommit:
+    """
+    Collect small writes from concurrent handlers, and commit them in one transaction every few milliseconds.
+    Each write runs in its own savepoint, so that its result or exception is only delivered to its caller after commit.
+    """
+
+    def __init__(self):
+        self.pending: Dict[int, list] = {}
+        self.timer: asyncio.TimerHandle = None
+
+    def enqueue(self, func, *args, **kw) -> asyncio.Future:
+        """Add a synchronous write function to the next group commit, returns the future of its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        delay = config.get("database.group_commit.delay", 5)
+        if not delay:
+            try:
+                future.set_result(func(*args, **kw))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        batch = self.pending.setdefault(partitions.current.get(), [])
+        batch.append((copy_context(), partial(func, *args, **kw), future))
+        if len(batch) >= config.get("database.group_commit.max_batch", 200):
+            self.flush()
+        elif not self.timer:
+            self.timer = loop.call_later(delay / 1000, self.flush)
+        return future
+
+    async def run(self, func, *args, **kw):
+        """Run a synchronous write function in the next group commit, and return its result."""
+        return await self.enqueue(func, *args, **kw)
+
+    def submit(self, func, *args, **kw):
+        """Run a write function in the next group commit without waiting for it, failures are only logged."""
+        self.enqueue(func, *args, **kw).add_done_callback(self._report)
+
+    @staticmethod
+    def _report(future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            logger.opt(exception=future.exception()).warning("Group commit write error:")
+
+    def flush(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        pending, self.pending = self.pending, {}
+        for key, batch in pending.items():
+            self.commit(key, batch)
+
+    def transaction(self, key: int):
+        stack = ExitStack()
+        stack.enter_context(db.atomic())
+        if partitions.enabled and key is not None:
+            stack.enter_context(partitions.atomic())
+        return stack
+
+    def commit(self, key: int, batch: list):
+        results = []
+        try:
+            with partitions.using(key), self.transaction(key):
+                for context, func, future in batch:
+                    try:
+                        with self.transaction(key):
+                            results.append((future, context.run(func), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result, e in results:
+            if future.done():
+                continue
+            if e is None:
+                future.set_result(result)
+            else:
+                future.set_exception(e)
+
+
+committer = GroupCommit()
+
+
 class User(BaseModel):
     id = AutoField()
-    uid = IntegerField(unique=True)
+    uid = BigIntegerField(unique=True)
     username = CharField(index=True, null=True)
     firstname = CharField(index=True, null=True)
     lastname = CharField(index=True, null=True)
     created = DateTimeField(default=datetime.now)
 
+    role_cache: Dict[int, tuple] = LRUCache(lambda: cache_size("roles.cache_size"))
+
+    @classmethod
+    def create(cls, **query):
+        with db.atomic():
+            user = super().create(**query)
+            Statistic.add(users=1)
+            Statistic.put(latest_user=user.id)
+        return user
+
     @property
     def name(self):
         return " ".join([n for n in (self.firstname, self.lastname) if n])
@@ -148,10 +510,41 @@ class User(BaseModel):
         return self.validate([UserRole.PAYING, UserRole.AWARDED, UserRole.ADMIN, UserRole.CREATOR])
 
     def roles(self):
+        untils = self.role_untils()
         for r in UserRole:
-            if self.validate(r):
+            if self._role_valid(untils, r):
                 yield r
 
+    def role_untils(self) -> Dict[UserRole, datetime]:
+        """Expiry of each valid role of the user (None for never), cached by uid for "roles.cache_ttl" seconds."""
+        cached = User.role_cache.get(self.uid, None)
+        if cached and cached[0] > datetime.now():
+            return cached[1]
+        untils = {}
+        v: Validation
+        for v in self.s_validation_for().iterator():
+            if v.role in untils and (untils[v.role] is None or (v.until and v.until < untils[v.role])):
+                continue
+            untils[v.role] = v.until
+        User.role_cache[self.uid] = (datetime.now() + timedelta(seconds=config.get("roles.cache_ttl", 60)), untils)
+        return untils
+
+    def invalidate_roles(self):
+        User.role_cache.pop(self.uid, None)
+
+    @classmethod
+    def forget_roles(cls, uids: Iterable[int]):
+        """Drop cached roles of the users, e.g. when their group goes idle."""
+        for uid in uids:
+            cls.role_cache.pop(uid, None)
+
+    @staticmethod
+    def _role_valid(untils: Dict[UserRole, datetime], role: UserRole):
+        if role not in untils:
+            return False
+        until = untils[role]
+        return until is None or until > datetime.now()
+
     @classmethod
     def s_all_in_role(cls, roles: Iterable[UserRole]):
         return (
@@ -170,7 +563,8 @@ class User(BaseModel):
         return cls.s_all_in_role(roles).count()
 
     def validate(self, roles: Iterable[UserRole], fail=False, reversed=False):
-        if self.s_validation_for(roles).count():
+        untils = self.role_untils()
+        if any(self._role_valid(untils, r) for r in to_iterable(roles)):
             result = not reversed
         else:
             result = reversed
@@ -202,6 +596,7 @@ class User(BaseModel):
                     else:
                         until = datetime.now() + timedelta(days=days)
                     validation = Validation(user=self, role=role, until=until)
+                    Statistic.add(**{Statistic.role(role): 1})
                 else:
                     if days is None:
                         validation.until = None
@@ -211,6 +606,7 @@ class User(BaseModel):
                 if from_request:
                     from_request.used = validation
                     from_request.save()
+        self.invalidate_roles()
 
     def remove_validation(self, roles: Iterable[UserRole] = None):
         count = 0
@@ -219,7 +615,9 @@ class User(BaseModel):
             for v in self.s_validation_for(roles).iterator():
                 v.until = datetime.now()
                 v.save()
+                Statistic.add(**{Statistic.role(v.role): -1})
                 count += 1
+        self.invalidate_roles()
         return count
 
     def create_code(
@@ -269,6 +667,7 @@ class User(BaseModel):
                 if vc.code == code and not vc.used:
                     self.add_validation(vc.role, days=vc.days, from_request=vc)
                     used.append(vc)
+        self.invalidate_roles()
         return used
 
     def member_in(self, group: Group):
@@ -330,19 +729,45 @@ class BanGroup(BaseModel):
     id = AutoField()
     created = DateTimeField(default=datetime.now)
     until = DateTimeField(default=datetime.now, null=True)
+    mask = IntegerField(null=True, default=None)
 
     default_types = []
+    cache: Dict[int, tuple] = LRUCache(lambda: cache_size("bans.cache_size"))
 
     @classmethod
     def generate(cls, types: List[BanType] = None, until: datetime = None):
         if types is None:
             types = cls.default_types
+        mask = BanType.to_mask(types)
         with db.atomic():
-            group = cls.create(until=until)
+            group = cls.create(until=until, mask=mask)
             for t in to_iterable(types):
                 BanGroupEntry.create(type=t, group=group)
+        cls.cache[group.id] = (mask, until)
         return group
 
+    @classmethod
+    def lookup(cls, id: int):
+        """Get (mask, until) of a ban group from cache, the mask is computed from entries for legacy ban groups."""
+        cached = cls.cache.get(id, None)
+        if cached is None:
+            group: BanGroup = cls.get_by_id(id)
+            if group.mask is None:
+                group.mask = BanType.to_mask(e.type for e in group.entries.iterator())
+                group.save()
+            cached = cls.cache[id] = (group.mask, group.until)
+        return cached
+
+    @classmethod
+    def invalidate(cls, id: int):
+        cls.cache.pop(id, None)
+
+    @classmethod
+    def forget(cls, ids: Iterable[int]):
+        """Drop cached masks of the ban groups, e.g. when their group goes idle."""
+        for id in ids:
+            cls.cache.pop(id, None)
+
 
 class BanGroupEntry(BaseModel):
     id = AutoField()
@@ -352,7 +777,7 @@ class BanGroupEntry(BaseModel):
 
 class Group(BaseModel):
     id = AutoField()
-    uid = IntegerField(index=True)
+    uid = BigIntegerField(index=True)
     token = CharField(max_length=50, unique=True)
     username = CharField(index=True)
     title = CharField(index=True, null=True)
@@ -365,40 +790,82 @@ class Group(BaseModel):
     welcome_message_buttons = TextField(null=True, default=None)
     welcome_latest_messages = BooleanField(default=True)
     chat_instruction = TextField(null=True, default=None)
+    retention_days = IntegerField(null=True, default=None)
     disabled = BooleanField(default=False)
+    member_count = IntegerField(default=0)
+    message_count = IntegerField(default=0)
+
+    class Meta:
+        # Counters are only changed by increments in SQL, which saving a stale instance must not overwrite.
+        only_save_dirty = True
+
+    @classmethod
+    def create(cls, **query):
+        with db.atomic():
+            group = super().create(**query)
+            if not group.disabled:
+                Statistic.add(all_groups=1, groups=1, active_groups=1)
+            else:
+                Statistic.add(all_groups=1)
+        return group
 
     @property
     def n_members(self):
-        return self.members.where(Member.role >= MemberRole.GUEST).count()
-    
+        return Group.select(Group.member_count).where(Group.id == self.id).scalar()
+
+    def forget_caches(self):
+        """Drop process-wide caches of the members of the group, which are refilled on demand."""
+        members = list(User.select(User.uid, Member.ban_group).join(Member).where(Member.group == self.id).tuples())
+        User.forget_roles(uid for uid, _ in members)
+        BanGroup.forget([self.default_ban_group_id, *(b for _, b in members if b)])
+
     @classmethod
     def get_avg_n_members(cls):
-        query = (
-            Member
-            .select(Member.group, fn.COUNT(Member.id).alias('count'))
-            .where(Member.role >= MemberRole.GUEST)
-            .group_by(Member.group)
-        )
-
-        try:
-            average = sum(q.count for q in query) / len(query)
-        except ZeroDivisionError:
-            return 0
-        else:
-            return average
+        return cls.select(fn.AVG(cls.member_count)).where(cls.member_count > 0).scalar() or 0
 
     @property
     def n_messages(self):
-        return self.messages.count()
-    
+        return Group.select(Group.message_count).where(Group.id == self.id).scalar()
+
+    def recount(self):
+        """
+        Recount member and message counters of the group and its members from scratch, returns number of fixed rows.
+        Counters are read before counting and only replaced if still unchanged, so that writes running alongside
+        (e.g. from another thread) are never overwritten; a counter changed meanwhile is left to the next recount.
+        """
+        members, messages = Group.select(Group.member_count, Group.message_count).where(Group.id == self.id).tuples().get()
+        current = dict(Member.select(Member.id, Member.message_count).where(Member.group == self.id).tuples())
+        n_members = self.members.where(Member.role >= MemberRole.GUEST).count()
+        with partitions.using(self.id):
+            counts = dict(
+                Message.select(Message.member, fn.COUNT(Message.id)).where(Message.group == self.id).group_by(Message.member).tuples()
+            )
+        n_messages = sum(counts.values())
+        fixed = 0
+        with db.atomic():
+            if not (members, messages) == (n_members, n_messages):
+                fixed += (
+                    Group.update(member_count=n_members, message_count=n_messages)
+                    .where(Group.id == self.id, Group.member_count == members, Group.message_count == messages)
+                    .execute()
+                )
+            for member_id, n in current.items():
+                if not n == counts.get(member_id, 0):
+                    fixed += (
+                        Member.update(message_count=counts.get(member_id, 0))
+                        .where(Member.id == member_id, Member.message_count == n)
+                        .execute()
+                    )
+        return fixed
+
     @property
     def is_prime(self):
         return self.creator.is_prime
 
     def default_bans(self):
-        e: BanType
-        for e in self.default_ban_group.entries.iterator():
-            yield e.type
+        mask, _ = BanGroup.lookup(self.default_ban_group_id)
+        for t in BanType.from_mask(mask):
+            yield t
 
     def s_all_has_role(self, role: MemberRole):
         return self.members.where(Member.role >= role, Member.role >= MemberRole.GUEST)
@@ -425,18 +892,62 @@ class Group(BaseModel):
         else:
             member_ids = [m.id for m in to_iterable(members)]
             m: Message
-            for m in self.messages.join(Member).where(Member.id << member_ids).iterator():
+            for m in self.messages.where(Message.member << member_ids).iterator():
                 yield m
 
     def touch(self):
         self.last_activity = datetime.now()
         self.save()
 
+    def disable(self):
+        with db.atomic():
+            if not self.disabled:
+                active = self.last_activity >= datetime.now() - timedelta(days=Statistic.active_days)
+                Statistic.add(groups=-1, active_groups=-int(active))
+            self.disabled = True
+            self.save()
+
+    def retention_cutoff(self):
+        """Messages created before the cutoff are expired, returns None if messages are retained forever."""
+        if self.retention_days is None:
+            days = config.get("retention.days", None)
+        else:
+            days = self.retention_days
+        if days:
+            return datetime.now() - timedelta(days=days)
+        else:
+            return None
+
+    def compact(self, chunk: int = 1000):
+        """Delete one chunk of redirections of expired messages, returns number of deleted rows."""
+        cutoff = self.retention_cutoff()
+        if not cutoff:
+            return 0
+        expired = (
+            RedirectedMessage.select(RedirectedMessage.id)
+            .join(Message)
+            .where(Message.group == self.id, Message.created < cutoff)
+            .limit(chunk)
+        )
+        expired_maps = (
+            RedirectMap.select()
+            .join(Message)
+            .where(Message.group == self.id, Message.created < cutoff)
+            .limit(chunk)
+        )
+        with partitions.using(self.id), partitions.atomic():
+            count = RedirectedMessage.delete().where(RedirectedMessage.id << expired).execute()
+            rm: RedirectMap
+            for rm in list(expired_maps):
+                count += RedirectIndex.remove(rm.message_id, RedirectMap.unpack(rm.data))
+                count += rm.delete_instance()
+        return count
+
     def cannot(self, ban: BanType, fail=False):
-        group_scope: BanGroupEntry = self.default_ban_group.entries.where(BanGroupEntry.type == ban).get_or_none()
-        if group_scope:
+        mask, until = BanGroup.lookup(self.default_ban_group_id)
+        if mask & ban.bit:
             if fail:
-                raise BanError(type=ban, member=False, until=self.default_ban_group.until)
+                raise BanError(type=ban, member=False, until=until)
             return True
         return False
 
@@ -451,6 +962,20 @@ class Member(BaseModel):
     last_mask = CharField(null=True, default=None)
     pinned_mask = CharField(null=True, default=None)
     ban_group = ForeignKeyField(BanGroup, backref="linked_members", null=True)
+    message_count = IntegerField(default=0)
+
+    class Meta:
+        # Counters are only changed by increments in SQL, which saving a stale instance must not overwrite.
+        only_save_dirty = True
+
+    @classmethod
+    def create(cls, **query):
+        with db.atomic():
+            member = super().create(**query)
+            if member.role >= MemberRole.GUEST:
+                Group.update(member_count=Group.member_count + 1).where(Group.id == member.group_id).execute()
+                Statistic.add(members=1)
+        return member
 
     @property
     def is_banned(self):
@@ -458,12 +983,22 @@ class Member(BaseModel):
 
     @property
     def n_messages(self):
-        return self.messages.count()
+        return Member.select(Member.message_count).where(Member.id == self.id).scalar()
 
     def touch(self):
         self.last_activity = datetime.now()
         self.save()
 
+    def set_role(self, role: MemberRole):
+        """Change the role of the member, keeping member counters in step with joins and leaves."""
+        joined = int(role >= MemberRole.GUEST) - int(self.role >= MemberRole.GUEST)
+        with db.atomic():
+            self.role = role
+            self.save()
+            if joined:
+                Group.update(member_count=Group.member_count + joined).where(Group.id == self.group_id).execute()
+                Statistic.add(members=joined)
+
     def validate(self, role: MemberRole, fail=False, reversed=False):
         current_role = self.role
         if self.user.validate(UserRole.CREATOR, fail=False):
@@ -485,44 +1020,85 @@ class Member(BaseModel):
                 return True
 
     def check_ban(self, ban: BanType, fail=True, check_group=True):
+        return self.check_bans(ban.bit, fail=fail, check_group=check_group)
+
+    def check_bans(self, mask: int, fail=True, check_group=True):
+        """Check all ban types in the mask at once, BanError is raised for the first banned type."""
+        if not mask:
+            return False
         if self.validate(MemberRole.ADMIN):
             return False
-        if self.ban_group:
-            member_scope: BanGroupEntry = self.ban_group.entries.where(BanGroupEntry.type == ban).get_or_none()
-            if member_scope:
-                if fail:
-                    raise BanError(type=ban, member=True, until=self.ban_group.until)
-                return True
+        scopes = []
+        if self.ban_group_id:
+            scopes.append((True, *BanGroup.lookup(self.ban_group_id)))
         if check_group:
-            group_scope: BanGroupEntry = self.group.default_ban_group.entries.where(BanGroupEntry.type == ban).get_or_none()
-            if group_scope:
-                if fail:
-                    raise BanError(type=ban, member=False, until=self.group.default_ban_group.until)
-                return True
+            scopes.append((False, *BanGroup.lookup(self.group.default_ban_group_id)))
+        if not any(ban_mask & mask for _, ban_mask, _ in scopes):
+            return False
+        # Same order as checking each type in turn: types in declaration order, member scope before group scope.
+        for ban in BanType.from_mask(mask):
+            for member_scope, ban_mask, until in scopes:
+                if ban_mask & ban.bit:
+                    if fail:
+                        raise BanError(type=ban, member=member_scope, until=until)
+                    return True
         return False
             
-    def not_redirected_messages(self, limit: int = 10, days: int = 7):
+    def _redirected(self, messages: List[Message]):
+        """Ids of the messages which are redirected to the member, checked in one query for all messages."""
+        redirected = set()
+        rest = []
+        for m in messages:
+            mid = RedirectMap.get_mid(m.id, self.id, data=m.data) if RedirectMap.enabled() else Def
+            if mid is Def:
+                rest.append(m.id)
+            elif mid is not None:
+                redirected.add(m.id)
+        if rest:
+            query = RedirectedMessage.select(RedirectedMessage.message).where(
+                RedirectedMessage.message << rest, RedirectedMessage.to_member == self.id
+            )
+            redirected.update(i for i, in query.tuples())
+        return redirected
+
+    def _not_redirected(self, query, limit: int = None, cutoff: datetime = None, page: int = 50):
+        """
+        Walk messages of the query newest first, collecting those not redirected to the member until the first
+        redirected or own message, until limit, or until a message older than cutoff is collected.
+        Messages are fetched and checked page by page, and expired messages are never collected.
+        """
+        if RedirectMap.enabled():
+            query = query.select_extend(RedirectMap.data).join(RedirectMap, JOIN.LEFT_OUTER).objects()
+        expired = self.group.retention_cutoff()
         results = []
-        for m in self.group.messages.order_by(Message.created.desc()).iterator():
-            if m.get_redirect_for(self) is None:
+        last = None
+        while True:
+            paged = query
+            if last:
+                paged = paged.where((Message.created < last.created) | ((Message.created == last.created) & (Message.id < last.id)))
+            messages = list(paged.order_by(Message.created.desc(), Message.id.desc()).limit(page))
+            redirected = self._redirected([m for m in messages if not m.member_id == self.id])
+            for m in messages:
+                if m.member_id == self.id or m.id in redirected:
+                    return results
+                if expired and m.created < expired:
+                    return results
                 results.append(m)
-                if len(results) >= limit:
-                    break
-                if m.created < datetime.now() - timedelta(days=days):
-                    break
-            else:
-                break
-        return results
-    
+                if (limit and len(results) >= limit) or (cutoff and m.created < cutoff):
+                    return results
+            if len(messages) < page:
+                return results
+            last = messages[-1]
+
+    def not_redirected_messages(self, limit: int = 10, days: int = 7):
+        query = Message.select(Message).where(Message.group == self.group_id)
+        return self._not_redirected(query, limit=limit, cutoff=datetime.now() - timedelta(days=days), page=limit + 1)
+
     def not_redirected_pinned_messages(self):
-        results = []
-        for m in self.group.messages.where(Message.pinned == True).order_by(Message.created.desc()).iterator():
-            if m.get_redirect_for(self) is None:
-                results.append(m)
-            else:
-                break
-        return results
-    
+        # The bare column matches the condition of the partial index, which a bound parameter would not.
+        query = Message.select(Message).where(Message.group == self.group_id, Message.pinned)
+        return self._not_redirected(query)
+
     def s_pinned_messages(self):
         return self.group.messages.where(Message.pinned == True).order_by(Message.created.desc())
     
@@ -541,12 +1117,69 @@ class Message(BaseModel):
     updated = DateTimeField(default=datetime.now)
     created = DateTimeField(default=datetime.now)
 
+    class Meta:
+        database = partitions
+        indexes = ((("group", "created"), False),)
+
+    @classmethod
+    def create(cls, **query):
+        # The row may live in a partition while the counters are central, so both transactions are entered.
+        # They commit one after another, and drifted counters are fixed by the statistician.
+        with db.atomic(), partitions.atomic():
+            message = super().create(**query)
+            Group.update(message_count=Group.message_count + 1).where(Group.id == message.group_id).execute()
+            Member.update(message_count=Member.message_count + 1).where(Member.id == message.member_id).execute()
+            Statistic.add(messages=1)
+        return message
+
+    @property
+    def expired(self):
+        cutoff = self.group.retention_cutoff()
+        return bool(cutoff) and self.created < cutoff
+
     def get_redirect_for(self, member: Member):
-        if member.id == self.member.id:
+        if member.id == self.member_id:
             return self
+        if RedirectMap.enabled():
+            mid = RedirectMap.get_mid(self.id, member.id)
+            if mid is None:
+                return None
+            elif mid is not Def:
+                return RedirectedMessage(mid=mid, message=self, to_member=member)
+        else:
+            mid = RedirectedMessage.get_pending(self.id, member.id)
+            if mid is not None:
+                return RedirectedMessage(mid=mid, message=self, to_member=member)
+        return RedirectedMessage.get_or_none(message=self, to_member=member)
+
+    def add_redirect(self, member: Member, mid: int):
+        """Record that the message is redirected to the member as mid, call `flush_redirects` after adding."""
+        if RedirectMap.enabled():
+            RedirectMap.add(self.id, member.id, mid)
         else:
-            rm: RedirectedMessage = self.redirects.join(Member).where(Member.id == member.id).get_or_none()
-            return rm
+            RedirectedMessage.add(self.id, member.id, mid)
+
+    def flush_redirects(self):
+        if RedirectMap.enabled():
+            RedirectMap.flush(self.id)
+        else:
+            RedirectedMessage.flush(self.id)
+
+    @classmethod
+    def from_redirect(cls, member: Member, mid: int):
+        """Get the message which is redirected to the member as mid."""
+        if RedirectMap.enabled():
+            message_id = RedirectIndex.get_message_id(member.id, mid)
+        else:
+            message_id = RedirectIndex.pending.get((member.id, mid), None)
+        if message_id is not None:
+            return cls.get_or_none(id=message_id)
+        rmr: RedirectedMessage = RedirectedMessage.get_or_none(mid=mid, to_member=member)
+        return rmr.message if rmr else None
+
+
+# Pinned messages are rare, so catching up pins walks this partial index instead of every message of the group.
+Message.add_index(Message.index(Message.group, Message.created, where=Message.pinned, name="message_group_id_created_pinned"))
 
 
 class RedirectedMessage(BaseModel):
@@ -556,6 +1189,152 @@ class RedirectedMessage(BaseModel):
     to_member = ForeignKeyField(Member, backref="redirected_messages")
     created = DateTimeField(default=datetime.now)
 
+    pending: Dict[tuple, Dict[int, int]] = {}
+
+    class Meta:
+        database = partitions
+        indexes = ((("message", "to_member"), False),)
+
+    @classmethod
+    def get_pending(cls, message_id: int, member_id: int):
+        return cls.pending.get((partitions.current.get(), message_id), {}).get(member_id, None)
+
+    @classmethod
+    def add(cls, message_id: int, member_id: int, mid: int):
+        cls.pending.setdefault((partitions.current.get(), message_id), {})[member_id] = mid
+        RedirectIndex.pending[(member_id, mid)] = message_id
+
+    @classmethod
+    def flush(cls, message_id: int):
+        """Write pending redirections of a message in one transaction."""
+        key = (partitions.current.get(), message_id)
+        pairs = cls.pending.get(key, None)
+        if not pairs:
+            cls.pending.pop(key, None)
+            return
+        with partitions.atomic():
+            rows = [(r, message_id, m) for m, r in pairs.items()]
+            for rows_batch in chunked(rows, 300):
+                cls.insert_many(rows_batch, fields=[cls.mid, cls.message, cls.to_member]).execute()
+        del cls.pending[key]
+        for m, r in pairs.items():
+            RedirectIndex.pending.pop((m, r), None)
+
+
+class RedirectMap(BaseModel):
+    """
+    Compact storage of redirections, used when "database.redirect_format" is "packed".
+    All redirections of a message are stored in one row, packed as (member id, mid) pairs sorted by member id.
+    """
+
+    message = ForeignKeyField(Message, primary_key=True, backref="redirect_map")
+    data = BlobField()
+
+    pair = struct.Struct("<II")
+    pending: Dict[tuple, Dict[int, int]] = {}
+
+    class Meta:
+        database = partitions
+
+    @staticmethod
+    def enabled():
+        return config.get("database.redirect_format", "rows") == "packed"
+
+    @classmethod
+    def pack(cls, pairs: Dict[int, int]):
+        return b"".join(cls.pair.pack(m, r) for m, r in sorted(pairs.items()))
+
+    @classmethod
+    def unpack(cls, data: bytes):
+        return dict(cls.pair.iter_unpack(data)) if data else {}
+
+    @classmethod
+    def search(cls, data: bytes, member_id: int):
+        """Binary search the redirected mid for the member in packed data."""
+        lo, hi = 0, len(data) // cls.pair.size
+        while lo < hi:
+            i = (lo + hi) // 2
+            m, r = cls.pair.unpack_from(data, i * cls.pair.size)
+            if m < member_id:
+                lo = i + 1
+            elif m > member_id:
+                hi = i
+            else:
+                return r
+        return None
+
+    @classmethod
+    def get_mid(cls, message_id: int, member_id: int, data: bytes = Def):
+        """Get the redirected mid for the member, returns Def if the message has no packed redirections."""
+        pending = cls.pending.get((partitions.current.get(), message_id), None)
+        if pending and member_id in pending:
+            return pending[member_id]
+        if data is Def:
+            data = cls.select(cls.data).where(cls.message == message_id).scalar()
+        if data is None:
+            return None if pending is not None else Def
+        return cls.search(data, member_id)
+
+    @classmethod
+    def add(cls, message_id: int, member_id: int, mid: int):
+        cls.pending.setdefault((partitions.current.get(), message_id), {})[member_id] = mid
+        RedirectIndex.pending[(member_id, mid)] = message_id
+
+    @classmethod
+    def flush(cls, message_id: int):
+        """Write pending redirections of a message in one transaction."""
+        key = (partitions.current.get(), message_id)
+        pairs = cls.pending.get(key, None)
+        if not pairs:
+            cls.pending.pop(key, None)
+            return
+        with partitions.atomic():
+            stored = cls.select(cls.data).where(cls.message == message_id).scalar()
+            merged = cls.unpack(stored)
+            merged.update(pairs)
+            data = cls.pack(merged)
+            cls.insert(message=message_id, data=data).on_conflict(conflict_target=[cls.message], update={cls.data: data}).execute()
+            rows = [(m, r, message_id) for m, r in pairs.items()]
+            for rows_batch in chunked(rows, 300):
+                RedirectIndex.insert_many(
+                    rows_batch, fields=[RedirectIndex.member, RedirectIndex.mid, RedirectIndex.message]
+                ).on_conflict_ignore().execute()
+        del cls.pending[key]
+        for m, r in pairs.items():
+            RedirectIndex.pending.pop((m, r), None)
+
+
+class RedirectIndex(BaseModel):
+    """
+    Reverse index of packed redirections, to find the message from its redirected mid in a member's chat.
+    Pending entries also cover redirections of either format which are not flushed yet.
+    """
+
+    member = ForeignKeyField(Member, index=False)
+    mid = IntegerField()
+    message = ForeignKeyField(Message, index=False)
+
+    pending: Dict[tuple, int] = {}
+
+    class Meta:
+        database = partitions
+        primary_key = CompositeKey("member", "mid")
+        without_rowid = True
+
+    @classmethod
+    def get_message_id(cls, member_id: int, mid: int):
+        message_id = cls.pending.get((member_id, mid), None)
+        if message_id is None:
+            message_id = cls.select(cls.message).where(cls.member == member_id, cls.mid == mid).scalar()
+        return message_id
+
+    @classmethod
+    def remove(cls, message_id: int, pairs: Dict[int, int]):
+        count = 0
+        for pairs_batch in chunked(list(pairs.items()), 300):
+            count += cls.delete().where(Tuple(cls.member, cls.mid) << pairs_batch, cls.message == message_id).execute()
+        return count
+
 
 class PMBan(BaseModel):
     id = AutoField()
@@ -571,7 +1350,10 @@ class PMMessage(BaseModel):
     mid = IntegerField(index=True)
     redirected_mid = IntegerField(index=True)
     time = DateTimeField(default=datetime.now)
-    
+
+    class Meta:
+        database = partitions
+
 class DevPMBan(BaseModel):
     id = AutoField()
     user = ForeignKeyField(User, backref="pm_bans")
@@ -582,4 +1364,84 @@ class DevPMLog(BaseModel):
     user = ForeignKeyField(User, backref="pm_logs")
     message = IntegerField(unique=True)
     redirected_message = IntegerField(unique=True)
-    time = DateTimeField(default=datetime.now)
\ No newline at end of file
+    time = DateTimeField(default=datetime.now)
+
+
+class Statistic(BaseModel):
+    """
+    System-wide counters shown in the admin panel, updated by write paths in the same transaction.
+    Counters that drift with time (expiring roles, group activity) are corrected by `recount` periodically.
+    """
+
+    name = CharField(primary_key=True)
+    value = BigIntegerField(default=0)
+    updated = DateTimeField(default=datetime.now)
+
+    active_days = 7
+
+    @staticmethod
+    def role(role: UserRole):
+        return f"role_{role.name.lower()}"
+
+    @classmethod
+    def add(cls, **deltas: int):
+        for name, n in deltas.items():
+            if n:
+                cls.insert(name=name, value=n).on_conflict(
+                    conflict_target=[cls.name], update={cls.value: cls.value + n}
+                ).execute()
+
+    @classmethod
+    def put(cls, expected: Dict[str, int] = None, **values: int):
+        """Set counters, skipping those which no longer hold the value in `expected` (if given for them)."""
+        now = datetime.now()
+        for name, value in values.items():
+            if expected and name in expected:
+                cls.update(value=value, updated=now).where(cls.name == name, cls.value == expected[name]).execute()
+            else:
+                cls.insert(name=name, value=value, updated=now).on_conflict(
+                    conflict_target=[cls.name], update={cls.value: value, cls.updated: now}
+                ).execute()
+
+    @classmethod
+    def snapshot(cls) -> Dict[str, int]:
+        return {s.name: s.value for s in cls.select()}
+
+    @classmethod
+    def recount(cls):
+        """Recount all counters from scratch, leaving counters changed by writes meanwhile to the next recount."""
+        expected = cls.snapshot()
+        date_ago = datetime.now() - timedelta(days=cls.active_days)
+        values = {
+            "users": User.select().count(),
+            "latest_user": User.select(User.id).order_by(User.created.desc()).limit(1).scalar() or 0,
+            "all_groups": Group.select().count(),
+            "groups": Group.select().where(~(Group.disabled)).count(),
+            "active_groups": Group.select().where(~(Group.disabled), Group.last_activity >= date_ago).count(),
+            "members": Member.select().where(Member.role >= MemberRole.GUEST).count(),
+            "messages": sum(Message.select().count() for _ in partitions.each()),
+        }
+        for r in UserRole:
+            values[cls.role(r)] = User.n_in_role(r)
+        with db.atomic():
+            cls.put(expected, **values)
+        return values
+
+
+partitions.models = [Message, RedirectedMessage, RedirectMap, RedirectIndex, PMMessage]
+
+
+def migrate_tables(database: Database = db, models: List[Type[Model]] = None):
+    """Add columns of newly defined fields to existing tables."""
+    if models is None:
+        models = BaseModel.__subclasses__()
+    migrator = SchemaMigrator.from_database(database)
+    operations = []
+    for model in models:
+        columns = [c.name for c in database.get_columns(model._meta.table_name)]
+        for field in model._meta.sorted_fields:
+            if field.column_name not in columns:
+                operations.append(migrator.add_column(model._meta.table_name, field.column_name, field))
+    if operations:
+        migrate(*operations)
+    return len(operations)
@@ -0,0 +1,424 @@
+"""Cost accounting of handlers, with the database, cache and Telegram API calls they make."""
+
+import asyncio
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+import sys
+import threading
+import time
+import traceback
+from types import CodeType, FrameType
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+import peewee
+import redis
+
+from .config import config
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float("inf"))
+
+
+@dataclass
+class Usage:
+    """Resources used in the current handler call."""
+
+    db_time: float = 0
+    queries: int = 0
+    cache_ops: int = 0
+    api_calls: int = 0
+
+
+usage: ContextVar[Usage] = ContextVar("usage", default=None)
+
+
+class Histogram:
+    """
+    Histogram of observed durations, kept both in total and over a rolling window.
+    The window is made of fixed time slots, the oldest of which is dropped as time goes on.
+    """
+
+    def __init__(self, window: int = None, slots: int = 10):
+        self.window = window
+        self.slots = deque(maxlen=slots)
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def _slot(self):
+        """Index of the current time slot, the window length is read from config on first use."""
+        if not self.window:
+            self.window = config.get("telemetry.window", 600)
+        return time.monotonic() // (self.window / self.slots.maxlen)
+
+    def observe(self, value: float):
+        i = bisect_left(BUCKETS, value)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+        current = self._slot()
+        if not self.slots or self.slots[-1][0] != current:
+            self.slots.append((current, [0] * len(BUCKETS), [0.0]))
+        _, counts, total = self.slots[-1]
+        counts[i] += 1
+        total[0] += value
+
+    def recent(self):
+        """Bucket counts and sum of values over the rolling window."""
+        oldest = self._slot() - self.slots.maxlen + 1
+        counts = [0] * len(BUCKETS)
+        total = 0.0
+        for start, c, t in self.slots:
+            if start < oldest:
+                continue
+            for i, n in enumerate(c):
+                counts[i] += n
+            total += t[0]
+        return counts, total
+
+    def quantile(self, q: float):
+        """Upper bound of the bucket holding the q quantile in the rolling window, None if empty."""
+        counts, _ = self.recent()
+        n = sum(counts)
+        if not n:
+            return None
+        rank = q * n
+        seen = 0
+        for bound, c in zip(BUCKETS, counts):
+            seen += c
+            if seen >= rank:
+                return bound
+        return BUCKETS[-1]
+
+
+class HandlerStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.db_time = Histogram()
+        self.calls = 0
+        self.slow = 0
+        self.queries = 0
+        self.cache_ops = 0
+        self.api_calls = 0
+
+    def record(self, latency: float, u: Usage):
+        self.latency.observe(latency)
+        self.db_time.observe(u.db_time)
+        self.calls += 1
+        self.queries += u.queries
+        self.cache_ops += u.cache_ops
+        self.api_calls += u.api_calls
+
+    def summary(self):
+        counts, total = self.latency.recent()
+        n = sum(counts)
+        return {
+            "calls": self.calls,
+            "recent": n,
+            "mean": total / n if n else None,
+            "p50": self.latency.quantile(0.5),
+            "p99": self.latency.quantile(0.99),
+            "slow": self.slow,
+            "queries": self.queries / self.calls if self.calls else 0,
+            "db_time": self.db_time.sum / self.calls if self.calls else 0,
+            "cache_ops": self.cache_ops / self.calls if self.calls else 0,
+            "api_calls": self.api_calls / self.calls if self.calls else 0,
+        }
+
+
+class DeliveryStats:
+    """
+    Sends and operations of group workers, aggregated in memory.
+    Totals are flushed periodically into the cached worker status with `take_unreported`.
+    """
+
+    def __init__(self):
+        self.send_latency = Histogram()
+        self.op_latency = Histogram()
+        self.sends = 0
+        self.errors = 0
+        self.send_time = 0.0
+        self.ops = 0
+        self.active = 0
+        self.busy_time = 0.0
+        self._busy_since = None
+        self._history = deque(maxlen=10)
+        self._reported = (0, 0, 0.0)
+
+    def send(self, latency: float, error: bool = False):
+        self.send_latency.observe(latency)
+        self.sends += 1
+        self.errors += int(error)
+        self.send_time += latency
+
+    def begin(self):
+        if not self.active:
+            self._busy_since = time.monotonic()
+        self.active += 1
+
+    def end(self, latency: float):
+        self.active -= 1
+        self.ops += 1
+        self.op_latency.observe(latency)
+        if not self.active:
+            self.busy_time += time.monotonic() - self._busy_since
+
+    def busy(self):
+        """Seconds during which at least one operation was running."""
+        if self.active:
+            return self.busy_time + time.monotonic() - self._busy_since
+        return self.busy_time
+
+    def throughput(self):
+        """Recipients served per busy second, over the history of recent flushes if possible, None if unmeasured."""
+        busy = self.busy()
+        for _, sends, busy_then in self._history:
+            if busy - busy_then >= 1:
+                return (self.sends - sends) / (busy - busy_then)
+        if busy >= 1:
+            return self.sends / busy
+        return None
+
+    def take_unreported(self):
+        """Get (send time, sends, errors) since the last call, also taking a snapshot for `throughput`."""
+        sends, errors, send_time = self._reported
+        self._reported = (self.sends, self.errors, self.send_time)
+        self._history.append((time.monotonic(), self.sends, self.busy()))
+        return self.send_time - send_time, self.sends - sends, self.errors - errors
+
+
+class ApiStats:
+    """Telegram API calls of all bots, by method and by bot."""
+
+    def __init__(self):
+        self.methods: Dict[str, Histogram] = {}
+        self.bots: Dict[str, int] = {}
+        self.errors: Dict[Tuple[str, str], int] = {}
+        self.flood_waits: Dict[str, float] = {}
+        self.flood_wait = Histogram()
+
+    def call(self, method: str, bot: str, latency: float, error: str = None):
+        h = self.methods.get(method, None)
+        if not h:
+            h = self.methods[method] = Histogram()
+        h.observe(latency)
+        self.bots[bot] = self.bots.get(bot, 0) + 1
+        if error:
+            self.errors[method, error] = self.errors.get((method, error), 0) + 1
+
+    def flood(self, method: str, seconds: float):
+        """Record a FloodWait received from Telegram, whether it is slept through by pyrogram or raised."""
+        self.flood_wait.observe(seconds)
+        self.flood_waits[method] = self.flood_waits.get(method, 0.0) + seconds
+
+    @property
+    def calls(self):
+        return sum(self.bots.values())
+
+    def summary(self, method: str):
+        h = self.methods[method]
+        counts, total = h.recent()
+        n = sum(counts)
+        return {
+            "calls": h.count,
+            "recent": n,
+            "mean": total / n if n else None,
+            "p99": h.quantile(0.99),
+            "errors": sum(c for (m, _), c in self.errors.items() if m == method),
+            "flood_wait": self.flood_waits.get(method, 0.0),
+        }
+
+    def busiest(self, n: int = 5) -> List[tuple]:
+        """Methods with the most calls in the rolling window, as (name, summary)."""
+        summaries = [(m, self.summary(m)) for m in list(self.methods)]
+        return sorted(summaries, key=lambda x: x[1]["recent"], reverse=True)[:n]
+
+
+@dataclass
+class StallReport:
+    """An event loop stall, with the stack of the blocking code captured while it was still running."""
+
+    time: datetime
+    activity: str
+    stack: List[str]
+    lag: float
+
+
+handlers: Dict[str, HandlerStats] = {}
+deliveries = DeliveryStats()
+api = ApiStats()
+db_latency = Histogram()
+cache_latency = Histogram()
+loop_lag = Histogram()
+stalls: Deque[StallReport] = deque(maxlen=20)
+stall: StallReport = None
+heartbeat = 0.0
+handler_codes: Set[CodeType] = set()
+activities: List[Callable[[FrameType], Optional[str]]] = []
+
+
+def count(field: str, n: int = 1):
+    """Add to the usage of the current handler call, if any."""
+    u = usage.get()
+    if u:
+        setattr(u, field, getattr(u, field) + n)
+
+
+@contextmanager
+def measure(name: str):
+    """
+    Account a handler call, which is logged if it takes longer than "telemetry.slow_handler" seconds.
+    Usage of nested calls is also added to the outer one.
+    """
+    parent = usage.get()
+    u = Usage()
+    token = usage.set(u)
+    start = time.perf_counter()
+    try:
+        yield u
+    finally:
+        latency = time.perf_counter() - start
+        usage.reset(token)
+        if parent:
+            parent.db_time += u.db_time
+            parent.queries += u.queries
+            parent.cache_ops += u.cache_ops
+            parent.api_calls += u.api_calls
+        stats = handlers.get(name, None)
+        if not stats:
+            stats = handlers[name] = HandlerStats()
+        stats.record(latency, u)
+        if latency > config.get("telemetry.slow_handler", 10):
+            stats.slow += 1
+            logger.warning(
+                f'Slow handler "{name}": {latency:.2f}s, with {u.queries} queries in {u.db_time:.2f}s, '
+                f"{u.cache_ops} cache commands and {u.api_calls} API calls."
+            )
+
+
+def instrument(name: str):
+    """Decorate an async handler to be accounted as name."""
+
+    def deco(func):
+        @wraps(func)
+        async def wrapper(*args, **kw):
+            with measure(name):
+                return await func(*args, **kw)
+
+        handler_codes.add(wrapper.__code__)
+        return wrapper
+
+    return deco
+
+
+def patch_clients():
+    """Time database queries and cache commands, also counting them into the current handler usage."""
+    if getattr(peewee.Database.execute_sql, "instrumented", False):
+        return
+
+    execute_sql = peewee.Database.execute_sql
+    execute_command = redis.Redis.execute_command
+
+    def timed_execute_sql(self, *args, **kw):
+        start = time.perf_counter()
+        try:
+            return execute_sql(self, *args, **kw)
+        finally:
+            spent = time.perf_counter() - start
+            db_latency.observe(spent)
+            u = usage.get()
+            if u:
+                u.db_time += spent
+                u.queries += 1
+
+    def timed_execute_command(self, *args, **kw):
+        start = time.perf_counter()
+        try:
+            return execute_command(self, *args, **kw)
+        finally:
+            cache_latency.observe(time.perf_counter() - start)
+            count("cache_ops")
+
+    timed_execute_sql.instrumented = True
+    peewee.Database.execute_sql = timed_execute_sql
+    redis.Redis.execute_command = timed_execute_command
+
+
+def activity(frame: FrameType):
+    """Name of the handler or worker operation that a frame runs in, found by walking its callers."""
+    while frame:
+        if frame.f_code in handler_codes:
+            return frame.f_locals.get("name", None)
+        for describe in activities:
+            name = describe(frame)
+            if name:
+                return name
+        frame = frame.f_back
+    return None
+
+
+def watchdog(thread: int, interval: float, threshold: float):
+    """
+    Run in a separate thread, watching the heartbeat of `lag_monitor`.
+    When the loop is stalled over threshold, the stack of the loop thread is captured once per stall.
+    """
+    global stall
+    reported = None
+    while True:
+        time.sleep(min(interval, threshold) / 4)
+        beat = heartbeat
+        if beat == reported:
+            continue
+        lag = time.monotonic() - beat - interval
+        if lag < threshold:
+            continue
+        frame = sys._current_frames().get(thread, None)
+        if not frame:
+            continue
+        try:
+            name = activity(frame) or "unknown"
+        except Exception:
+            name = "unknown"
+        summary = traceback.StackSummary.extract(traceback.walk_stack(frame), limit=20, lookup_lines=False)
+        del frame
+        stack = [f"{Path(f.filename).name}:{f.lineno} {f.name}" for f in summary]
+        stall = StallReport(datetime.now(), name, stack, lag)
+        stalls.append(stall)
+        reported = beat
+        logger.warning(f'Event loop blocked for over {lag:.2f}s in "{name}", at:\n' + "\n".join(f"  {l}" for l in stack))
+
+
+async def lag_monitor():
+    """
+    Sample event loop lag, as the delay of a periodic sleep beyond its interval.
+    A watchdog thread reports stalls longer than "telemetry.stall_threshold" seconds.
+    """
+    global heartbeat, stall
+    interval = float(config.get("telemetry.lag_interval", 0.5))
+    threshold = float(config.get("telemetry.stall_threshold", 1))
+    heartbeat = time.monotonic()
+    if threshold > 0 and not any(t.name == "watchdog" for t in threading.enumerate()):
+        args = (threading.get_ident(), interval, threshold)
+        threading.Thread(target=watchdog, args=args, name="watchdog", daemon=True).start()
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        lag = max(0.0, now - heartbeat - interval)
+        loop_lag.observe(lag)
+        if stall:
+            stall.lag = lag
+            stall = None
+        heartbeat = now
+
+
+def slowest(n: int = 5) -> List[tuple]:
+    """Handlers with the highest p99 latency in the rolling window, as (name, summary)."""
+    summaries = [(name, s.summary()) for name, s in handlers.items()]
+    summaries = [(name, s) for name, s in summaries if s["recent"]]
+    return sorted(summaries, key=lambda x: x[1]["p99"], reverse=True)[:n]
@@ -1,10 +1,15 @@
 import asyncio
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 from datetime import timedelta
 import enum
+import heapq
 import inspect
+import itertools
 import re
-from typing import Any, Coroutine, Iterable, Union
+import sys
+import time
+from typing import Any, Callable, Coroutine, Dict, Iterable, Tuple, Union
 from datetime import timedelta
 
 class _DefaultType:
@@ -63,6 +68,134 @@ class AsyncTaskPool:
         return results
 
 
+class FairScheduler:
+    """
+    A weighted fair queuing scheduler of a limited number of slots, shared by multiple keys.
+    Each key gets slots in proportion to its weight when slots are contended.
+    """
+
+    def __init__(self, slots: Union[int, Callable[[], int]]):
+        self._slots = slots
+        self.running = 0
+        self.vtime = 0.0
+        self.finish: Dict[Any, float] = {}
+        self.waiters = []
+        self.seq = itertools.count()
+        self.stats: Dict[Any, Dict[str, float]] = {}
+
+    @property
+    def slots(self):
+        return self._slots() if callable(self._slots) else self._slots
+
+    @property
+    def waiting(self):
+        return sum(1 for w in self.waiters if not w[2].done())
+
+    @asynccontextmanager
+    async def slot(self, key, weight: float = 1):
+        start = max(self.vtime, self.finish.get(key, 0))
+        self.finish[key] = start + 1 / weight
+        stats = self.stats.setdefault(key, {"requests": 0, "wait": 0.0, "max_wait": 0.0})
+        t = time.perf_counter()
+        if self.running < self.slots and not self.waiters:
+            self.running += 1
+            self.vtime = start
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.waiters, (start, next(self.seq), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release()
+                raise
+        wait = time.perf_counter() - t
+        stats["requests"] += 1
+        stats["wait"] += wait
+        stats["max_wait"] = max(stats["max_wait"], wait)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        self.running -= 1
+        while self.waiters and self.running < self.slots:
+            start, _, future = heapq.heappop(self.waiters)
+            if future.done():
+                continue
+            self.running += 1
+            self.vtime = start
+            future.set_result(None)
+
+
+class RateLimiter:
+    """
+    Token buckets limiting the rate of calls for each key, refilled at rate per second up to burst tokens.
+    Callers reserve a token in order, and sleep until it is refilled.
+    """
+
+    def __init__(self, rate: Union[float, Callable[[], float]], burst: Union[int, Callable[[], int]] = 1):
+        self._rate = rate
+        self._burst = burst
+        self.buckets: Dict[Any, Tuple[float, float]] = {}
+
+    @property
+    def rate(self):
+        return self._rate() if callable(self._rate) else self._rate
+
+    @property
+    def burst(self):
+        return self._burst() if callable(self._burst) else self._burst
+
+    async def wait(self, key):
+        rate, burst = self.rate, self.burst
+        if not rate:
+            return
+        now = time.monotonic()
+        tokens, last = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - last) * rate) - 1
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > 4096:
+            self._prune(now, rate, burst)
+        if tokens < 0:
+            await asyncio.sleep(-tokens / rate)
+
+    def _prune(self, now: float, rate: float, burst: int):
+        """Forget keys whose buckets are full again, as a new bucket is full anyway."""
+        for key, (tokens, last) in list(self.buckets.items()):
+            if tokens + (now - last) * rate >= burst:
+                del self.buckets[key]
+
+
+class LRUCache(OrderedDict):
+    """
+    A dict holding at most maxsize entries, which evicts the least recently used ones when full.
+    Entries are refreshed by `get` and by setting, and maxsize can be a callable read on each insert.
+    """
+
+    def __init__(self, maxsize: Union[int, Callable[[], int]]):
+        super().__init__()
+        self._maxsize = maxsize
+
+    @property
+    def maxsize(self):
+        return self._maxsize() if callable(self._maxsize) else self._maxsize
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        maxsize = self.maxsize
+        while len(self) > maxsize:
+            self.popitem(last=False)
+
+
 def remove_prefix(text: str, prefix: str):
     """Remove prefix from the begining of test."""
     return text[text.startswith(prefix) and len(prefix) :]
@@ -105,6 +238,32 @@ def count(it: Iterable):
     return sum(1 for _ in it)
 
 
+def sizeof(obj, seen: set = None):
+    """Recursively calculate the memory size in bytes of an object and its contents."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or isinstance(obj, (type, type(sys), type(sizeof))):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k, seen) + sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sizeof(i, seen) for i in obj)
+    elif hasattr(obj, "__dict__"):
+        size += sizeof(vars(obj), seen)
+    return size
+
+
+def format_size(size: int):
+    """Format a size in bytes to a human readable str."""
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
 def truncate_str(text: str, length: int):
     """Truncate a str to a certain length, and the omitted part is represented by "..."."""
     return f"{text[:length + 3]}..." if len(text) > length else text
@@ -19,6 +19,7 @@ setup(
     ],
     description="Bot server for @anonyabbot in telegram.",
     install_requires=requirements,
+    extras_require={"postgres": ["psycopg2-binary"], "test": ["pytest", "psycopg2-binary"]},
     long_description=readme,
     long_description_content_type="text/markdown",
     include_package_data=True,
@@ -0,0 +1,200 @@
+"""
+Tests of the PostgreSQL backend against a real server.
+
+Set ANONYABBOT_TEST_POSTGRES to a libpq connection string or URI of a disposable database, for example
+"postgresql://postgres@localhost/anonyabbot_test". All tables in it are dropped and recreated by each test.
+The tests are skipped if it is not set, if psycopg2 is not installed, or if the server can not be reached.
+"""
+
+from datetime import datetime, timedelta
+import os
+import threading
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+from psycopg2.extensions import parse_dsn
+
+from anonyabbot.config import config
+from anonyabbot.model import (
+    BanGroup,
+    BanType,
+    BaseModel,
+    Group,
+    Member,
+    MemberRole,
+    Message,
+    RedirectIndex,
+    RedirectMap,
+    RedirectedMessage,
+    Statistic,
+    User,
+    db,
+    init_database,
+    migrate_tables,
+)
+
+DSN = os.environ.get("ANONYABBOT_TEST_POSTGRES", None)
+
+pytestmark = pytest.mark.skipif(not DSN, reason="ANONYABBOT_TEST_POSTGRES is not set")
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    conf_file = tmp_path_factory.mktemp("conf") / "config.toml"
+    conf_file.write_text('[father]\ntoken = "0:test"\n')
+    config.reload_conf(conf_file)
+    params = parse_dsn(DSN)
+    config["redis"] = None
+    config["database"] = {
+        "type": "postgresql",
+        "name": params.get("dbname", "anonyabbot"),
+        "host": params.get("host", "localhost"),
+        "port": int(params.get("port", 5432)),
+        "user": params.get("user", None),
+        "password": params.get("password", None),
+    }
+    database = init_database(None)
+    try:
+        database.connect(reuse_if_open=True)
+    except Exception as e:
+        pytest.skip(f"PostgreSQL server is not available: {e}")
+    yield database
+    database.close_all()
+
+
+@pytest.fixture
+def tables(database):
+    database.drop_tables(BaseModel.__subclasses__(), cascade=True)
+    database.create_tables(BaseModel.__subclasses__())
+    for pending in (RedirectMap.pending, RedirectIndex.pending, RedirectedMessage.pending):
+        pending.clear()
+    yield database
+
+
+@pytest.fixture(params=["rows", "packed"])
+def redirect_format(request):
+    config["database"]["redirect_format"] = request.param
+    yield request.param
+    config["database"]["redirect_format"] = "rows"
+
+
+def make_group(n_members: int = 3):
+    users = [User.create(uid=7_000_000_000 + i, firstname=f"User {i}") for i in range(n_members)]
+    group = Group.create(
+        uid=-1_000_000_000_123,
+        token="1:test",
+        username="test",
+        creator=users[0],
+        default_ban_group=BanGroup.generate([BanType.LINK]),
+    )
+    members = [
+        Member.create(group=group, user=u, role=MemberRole.CREATOR if i == 0 else MemberRole.MEMBER)
+        for i, u in enumerate(users)
+    ]
+    return group, members
+
+
+def column_types(database, table: str):
+    cursor = database.execute_sql(
+        "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = %s", (table,)
+    )
+    return dict(cursor.fetchall())
+
+
+def test_schema(tables):
+    assert migrate_tables() == 0
+    assert set(tables.get_tables()) >= {m._meta.table_name for m in BaseModel.__subclasses__()}
+    assert column_types(tables, "user")["uid"] == "bigint"
+    assert column_types(tables, "group")["uid"] == "bigint"
+    assert column_types(tables, "redirectmap")["data"] == "bytea"
+
+
+def test_big_uids(tables):
+    group, members = make_group()
+    assert User.get(User.uid == 7_000_000_002).id == members[2].user_id
+    assert Group.get_by_id(group.id).uid == -1_000_000_000_123
+
+
+def test_counters(tables):
+    group, members = make_group()
+    for i, m in enumerate(members * 2):
+        Message.create(group=group, mid=i + 1, member=m, mask="🎭")
+    assert Group.get_by_id(group.id).message_count == 6
+    assert Member.get_by_id(members[1].id).message_count == 2
+    snapshot = Statistic.snapshot()
+    assert snapshot["users"] == 3
+    assert snapshot["members"] == 3
+    assert snapshot["messages"] == 6
+    assert group.recount() == 0
+
+    Group.update(message_count=0).where(Group.id == group.id).execute()
+    Member.update(message_count=5).where(Member.id == members[0].id).execute()
+    assert group.recount() == 2
+    assert Group.get_by_id(group.id).message_count == 6
+    assert Member.get_by_id(members[0].id).message_count == 2
+    assert Statistic.recount()["messages"] == 6
+
+
+def test_redirects(tables, redirect_format):
+    group, (sender, first, second) = make_group()
+    message = Message.create(group=group, mid=1, member=sender, mask="🎭")
+    message.add_redirect(first, 11)
+    message.add_redirect(second, 12)
+    message.flush_redirects()
+    message.add_redirect(second, 13)
+    message.flush_redirects()
+
+    assert message.get_redirect_for(first).mid == 11
+    assert Message.from_redirect(second, 12).id == message.id
+    if redirect_format == "packed":
+        data = RedirectMap.get_by_id(message.id).data
+        assert RedirectMap.unpack(bytes(data)) == {first.id: 11, second.id: 13}
+        assert message.get_redirect_for(second).mid == 13
+        assert RedirectIndex.select().count() == 3
+    else:
+        assert RedirectedMessage.select().where(RedirectedMessage.message == message).count() == 3
+
+
+def test_catch_up(tables, redirect_format):
+    group, (sender, member, _) = make_group()
+    now = datetime.now()
+    messages = [
+        Message.create(group=group, mid=i + 1, member=sender, mask="🎭", created=now - timedelta(minutes=10 - i))
+        for i in range(10)
+    ]
+    for m in messages[:7]:
+        m.add_redirect(member, 100 + m.mid)
+        m.flush_redirects()
+    assert [m.id for m in member.not_redirected_messages()] == [m.id for m in reversed(messages[7:])]
+    assert [m.id for m in member.not_redirected_messages(limit=2)] == [messages[9].id, messages[8].id]
+
+
+def test_concurrent_writes(tables):
+    group, members = make_group()
+    n = 50
+    barrier = threading.Barrier(2)
+    errors = []
+
+    def write(member: Member, offset: int):
+        try:
+            barrier.wait()
+            for i in range(n):
+                with db.atomic():
+                    Message.create(group=group, mid=offset + i, member=member, mask="🎭")
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=write, args=(m, 1000 * (i + 1))) for i, m in enumerate(members[1:])]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert Message.select().count() == 2 * n
+    assert Group.get_by_id(group.id).message_count == 2 * n
+    assert Statistic.snapshot()["messages"] == 2 * n
+    assert group.recount() == 0